@@ -0,0 +1,224 @@
+# catalog_extraction.py
+# Motor único de extracción de títulos de catálogos web (un solo recorrido del árbol)
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bs4 import BeautifulSoup
+
+from selector_profiles import SelectorProfileStore, dominio_de, get_default_profile_store
+
+try:
+    import lxml.html
+    from lxml import etree
+    LXML_DISPONIBLE = True
+except ImportError:
+    LXML_DISPONIBLE = False
+
+# Selectores comunes en tiendas de libros (solo "tag", ".clase" o "tag.clase")
+SELECTORES_CATALOGO = [
+    ".book-item",
+    ".producto-libro",
+    ".product-title",
+    ".woocommerce-loop-product__title",
+    ".book-title",
+    ".titulo-libro",
+    ".entry-title",
+    "li.product",
+    "article",
+]
+
+# Encabezados y enlaces cuyo texto menciona literatura
+ETIQUETAS_TEXTO = ("h1", "h2", "h3", "h4", "a")
+
+PALABRAS_LIBROS = [
+    "libro", "novela", "cuento", "autor", "editorial",
+    "tapa dura", "tapa blanda", "historia", "poesía",
+    "literatura", "ensayo", "biografia",
+]
+
+# Palabras que indican papelería o no-libros
+EXCLUIR = [
+    "papeler", "utiles", "útiles", "escolar", "escolares",
+    "juguet", "oficina", "kinder", "ferreter",
+    "bazar", "souvenir", "supermercado", "farmacia",
+]
+
+# Clave del grupo de títulos hallados por palabras clave
+PALABRAS_CLAVE = "palabras_clave"
+
+# Títulos que debe producir un perfil aprendido para no volver al juego completo
+PERFIL_MINIMO_TITULOS = 3
+
+_SIN_TEXTO = ("script", "style", "template")
+
+Selector = Tuple[Optional[str], Optional[str]]
+
+
+def _parse_selector(selector: str) -> Selector:
+    tag, _, clase = selector.partition(".")
+    return (tag.lower() or None, clase or None)
+
+
+def _indexar(selectores: Sequence[str]):
+    """Indexa los selectores por clase y por etiqueta para resolverlos en O(1) por nodo."""
+    por_clase: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+    por_tag: Dict[str, List[str]] = {}
+    for sel in selectores:
+        tag, clase = _parse_selector(sel)
+        if clase:
+            por_clase.setdefault(clase, []).append((sel, tag))
+        elif tag:
+            por_tag.setdefault(tag, []).append(sel)
+    return por_clase, por_tag
+
+
+def _recorrer_lxml(html: str):
+    """Genera (etiqueta, clases, función de texto) por cada elemento (lxml)."""
+    root = lxml.html.fromstring(
+        html.encode("utf-8"), parser=lxml.html.HTMLParser(encoding="utf-8")
+    )
+    etree.strip_elements(root, *_SIN_TEXTO, with_tail=False)
+    etree.strip_elements(root, etree.Comment, with_tail=False)
+
+    for el in root.iter():
+        if not isinstance(el.tag, str):
+            continue
+        yield (
+            el.tag.lower(),
+            (el.get("class") or "").split(),
+            lambda el=el: "".join(t.strip() for t in el.itertext()),
+        )
+
+
+def _recorrer_bs4(html: str):
+    """Mismo recorrido con BeautifulSoup (html.parser) cuando no hay lxml."""
+    soup = BeautifulSoup(html, "html.parser")
+    for el in soup.find_all(True):
+        yield (
+            el.name.lower(),
+            el.get("class") or [],
+            lambda el=el: el.get_text(strip=True),
+        )
+
+
+def extraer_por_selector(
+    html: str,
+    selectores: Sequence[str] = SELECTORES_CATALOGO,
+    palabras: Iterable[str] = PALABRAS_LIBROS,
+) -> Dict[str, List[str]]:
+    """
+    Recorre el documento una sola vez y devuelve selector → textos (3 < len < 120)
+    en orden de documento, más PALABRAS_CLAVE → encabezados/enlaces que
+    mencionan alguna de `palabras`. El texto de cada nodo se calcula una vez.
+    """
+    por_clase, por_tag = _indexar(selectores)
+    palabras = [p.lower() for p in palabras]
+    grupos: Dict[str, List[str]] = {sel: [] for sel in selectores}
+    grupos[PALABRAS_CLAVE] = []
+
+    recorrer = _recorrer_lxml if LXML_DISPONIBLE else _recorrer_bs4
+
+    for tag, clases, texto_de in recorrer(html):
+        coincidencias = list(por_tag.get(tag, ()))
+        for clase in clases:
+            for sel, sel_tag in por_clase.get(clase, ()):
+                if (sel_tag is None or sel_tag == tag) and sel not in coincidencias:
+                    coincidencias.append(sel)
+        busca_palabras = bool(palabras) and tag in ETIQUETAS_TEXTO
+
+        if not coincidencias and not busca_palabras:
+            continue
+
+        t = texto_de()
+        if not 3 < len(t) < 120:
+            continue
+
+        for sel in coincidencias:
+            grupos[sel].append(t)
+        if busca_palabras:
+            low = t.lower()
+            if any(p in low for p in palabras):
+                grupos[PALABRAS_CLAVE].append(t)
+
+    return grupos
+
+
+def limpiar_titulos(items: Iterable[str], excluir: Iterable[str] = EXCLUIR, limite: int = 50) -> List[str]:
+    """Descarta papelería y textos de navegación y elimina duplicados en tiempo lineal."""
+    excluir = list(excluir)
+    vistos: Dict[str, None] = {}
+    for i in items:
+        low = i.lower()
+        if any(x in low for x in excluir):
+            continue
+        if low.startswith("leer más"):
+            continue
+        vistos.setdefault(i, None)
+        if len(vistos) >= limite:
+            break
+    return list(vistos)
+
+
+def _titulos(grupos: Dict[str, List[str]], selectores: Sequence[str], limite: int) -> List[str]:
+    items = [t for sel in selectores for t in grupos.get(sel, ())]
+    items.extend(grupos.get(PALABRAS_CLAVE, ()))
+    return limpiar_titulos(items, limite=limite)
+
+
+def extraer_titulos(
+    html: str,
+    selectores: Sequence[str] = SELECTORES_CATALOGO,
+    limite: int = 50,
+) -> List[str]:
+    """Títulos de un catálogo: coincidencias por selector (en su orden) y luego por palabras clave."""
+    try:
+        grupos = extraer_por_selector(html, selectores)
+    except Exception:
+        return []
+
+    return _titulos(grupos, selectores, limite)
+
+
+def extraer_titulos_perfilado(
+    html: str,
+    url: str,
+    limite: int = 50,
+    store: Optional[SelectorProfileStore] = None,
+) -> List[str]:
+    """
+    Como extraer_titulos, pero usando el perfil aprendido del dominio de
+    `url`: si existe, solo se evalúan sus selectores (y la búsqueda por
+    palabras clave solo si forma parte del perfil). Si el perfil ya no da
+    PERFIL_MINIMO_TITULOS, se extrae con el juego completo y el perfil se
+    reemplaza por los selectores que produjeron títulos.
+    """
+    store = store or get_default_profile_store()
+    dominio = dominio_de(url)
+    if store is None or not dominio:
+        return extraer_titulos(html, limite=limite)
+
+    perfil = store.get(dominio)
+    if perfil:
+        selectores = [sel for sel in perfil if sel != PALABRAS_CLAVE]
+        palabras = PALABRAS_LIBROS if PALABRAS_CLAVE in perfil else []
+        try:
+            grupos = extraer_por_selector(html, selectores, palabras)
+        except Exception:
+            return []
+        titulos = _titulos(grupos, selectores, limite)
+        if len(titulos) >= PERFIL_MINIMO_TITULOS:
+            return titulos
+
+    try:
+        grupos = extraer_por_selector(html)
+    except Exception:
+        return []
+
+    productivos = [
+        sel for sel in [*SELECTORES_CATALOGO, PALABRAS_CLAVE]
+        if limpiar_titulos(grupos[sel], limite=1)
+    ]
+    if productivos and productivos != perfil:
+        store.set(dominio, productivos)
+
+    return _titulos(grupos, SELECTORES_CATALOGO, limite)
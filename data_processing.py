@@ -1,34 +1,46 @@
 import csv
-import unicodedata
-import requests
+import hashlib
+import os
+import numpy as np
 import pandas as pd
+import threading
 import time
 import re
 from bs4 import BeautifulSoup
-from typing import Optional, Dict, Any, List
+from typing import Callable, Optional, Dict, Any, List, Tuple
 from collections import Counter
 import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import fetch_scheduler
+import gazetteer
+import http_cache
+import http_client
+from catalog_extraction import extraer_titulos_perfilado
+from geocode_cache import GEOCODE_NEGATIVE_TTL, GeocodeCache, QueryMemo, get_default_cache
+from geocode_store import GeocodeStore, clave_establecimiento, get_default_store, hash_direccion
+from rate_limiter import TokenBucket, backoff_delay, retry_after_seconds
+from text_normalization import (
+    normalize_province,
+    normalize_province_series,
+    normalize_text,
+    map_unique,
+    normalize_text_series,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    PYARROW_DISPONIBLE = True
+except ImportError:
+    PYARROW_DISPONIBLE = False
 
 # ============================================================
 # UTILIDADES BÁSICAS
 # ============================================================
 
-def normalize_text(text: str) -> str:
-    """Normaliza texto, elimina tildes y espacios repetidos."""
-    if not isinstance(text, str):
-        text = str(text) if text is not None else ""
-    text = unicodedata.normalize("NFKD", text)
-    text = "".join(ch for ch in text if not unicodedata.combining(ch))
-    return " ".join(text.lower().strip().split())
-
-
-def normalize_province(name: str) -> str:
-    """Convierte 'Los Ríos' → 'LOS RIOS', eliminando tildes y espacios."""
-    if not isinstance(name, str):
-        name = str(name)
-    name = unicodedata.normalize("NFKD", name)
-    name = name.encode("ascii", "ignore").decode("utf-8")
-    return name.strip().upper()
+# normalize_text / normalize_province viven en text_normalization y se
+# reexportan aquí por compatibilidad.
 
 
 # ============================================================
@@ -47,36 +59,273 @@ def detectar_separador(uploaded_file) -> str:
         return ";"
 
 
-def load_and_clean_data(uploaded_file) -> pd.DataFrame:
-    sep = detectar_separador(uploaded_file)
+# Filas por bloque en la lectura por streaming (modo chunked)
+CSV_CHUNKSIZE = 200_000
 
+
+def detectar_encoding(uploaded_file, sample_size: int = 65536) -> str:
+    """
+    Detecta el encoding a partir de una muestra (utf-8 si es válido, si no
+    latin1). Una muestra solo ASCII no decide nada: la lectura es estricta
+    y _leer_csv/iter_clean_chunks pasan a latin1 si el resto no es utf-8.
+    """
+    uploaded_file.seek(0)
+    sample = uploaded_file.read(sample_size)
     uploaded_file.seek(0)
+
+    if isinstance(sample, str):
+        return "utf-8"
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+
     try:
-        df = pd.read_csv(
-            uploaded_file,
-            sep=sep,
-            encoding="latin1",
-            dtype=str,
-            engine="python",
-            on_bad_lines="skip",
-        )
-    except Exception:
-        uploaded_file.seek(0)
-        df = pd.read_csv(
-            uploaded_file,
-            sep=sep,
-            encoding="utf-8",
-            dtype=str,
-            engine="python",
-            on_bad_lines="skip",
-        )
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # La muestra puede cortar un carácter multibyte al final
+        if len(sample) == sample_size and e.start >= len(sample) - 3:
+            return "utf-8"
+        return "latin1"
+
+
+# Columnas que usa el pipeline (modo compacto); la columna CIIU se detecta por nombre
+COLUMNAS_PIPELINE = [
+    "NUMERO_RUC",
+    "NUMERO_ESTABLECIMIENTO",
+    "NOMBRE_FANTASIA_COMERCIAL",
+    "DESCRIPCION_PROVINCIA_EST",
+    "DESCRIPCION_CANTON_EST",
+    "DESCRIPCION_PARROQUIA_EST",
+    "ESTADO_CONTRIBUYENTE",
+]
+
+# Columnas de baja cardinalidad que se guardan como categóricas en modo compacto
+COLUMNAS_CATEGORICAS = [
+    "DESCRIPCION_PROVINCIA_EST",
+    "DESCRIPCION_CANTON_EST",
+    "DESCRIPCION_PARROQUIA_EST",
+    "ESTADO_CONTRIBUYENTE",
+]
+
+
+def _es_columna_ciiu(col: str) -> bool:
+    return "ciiu" in col.lower()
+
+
+def _usar_columna(col: str) -> bool:
+    col = col.strip()
+    return col in COLUMNAS_PIPELINE or _es_columna_ciiu(col)
+
 
-    # Limpieza general de columnas
+def _limpiar_chunk(df: pd.DataFrame, compacto: bool = False) -> pd.DataFrame:
+    """Limpia nombres de columnas y valores (sin NaN, sin espacios extremos)."""
     df.columns = [c.strip() for c in df.columns]
 
     for col in df.columns:
         df[col] = df[col].fillna("").astype(str).str.strip()
+        if compacto and (col in COLUMNAS_CATEGORICAS or _es_columna_ciiu(col)):
+            df[col] = df[col].astype("category")
+
+    return df
+
+
+def _concat_chunks(chunks: List[pd.DataFrame], ignore_index: bool = True) -> pd.DataFrame:
+    """Concatena bloques unificando las categorías para no perder el dtype."""
+    if not chunks:
+        return pd.DataFrame()
+
+    categoricas = [
+        c for c in chunks[0].columns
+        if isinstance(chunks[0][c].dtype, pd.CategoricalDtype)
+    ]
+    if categoricas:
+        from pandas.api.types import union_categoricals
+
+        for col in categoricas:
+            cats = union_categoricals([ch[col] for ch in chunks]).categories
+            for ch in chunks:
+                ch[col] = ch[col].cat.set_categories(cats)
+
+    return pd.concat(chunks, ignore_index=ignore_index)
+
+
+def _leer_csv(
+    uploaded_file,
+    chunksize: Optional[int] = None,
+    compacto: bool = False,
+    encoding: Optional[str] = None,
+):
+    sep = detectar_separador(uploaded_file)
+    encoding = encoding or detectar_encoding(uploaded_file)
+
+    uploaded_file.seek(0)
+    return pd.read_csv(
+        uploaded_file,
+        sep=sep,
+        encoding=encoding,
+        encoding_errors="strict",
+        dtype=str,
+        engine="c",
+        on_bad_lines="skip",
+        usecols=_usar_columna if compacto else None,
+        chunksize=chunksize,
+    )
+
+
+def iter_clean_chunks(
+    uploaded_file,
+    chunksize: int = CSV_CHUNKSIZE,
+    provincia: Optional[str] = None,
+    compacto: bool = False,
+):
+    """
+    Lee el CSV por bloques con el motor C y devuelve cada bloque ya limpio.
+    Si se indica provincia, cada bloque se filtra antes de devolverse.
+    Si un bloque posterior a la muestra no es utf-8 válido, la lectura se
+    reinicia como latin1 saltando los bloques ya devueltos.
+    """
+    encoding = detectar_encoding(uploaded_file)
+    emitidos = 0
+
+    while True:
+        try:
+            with _leer_csv(
+                uploaded_file, chunksize=chunksize, compacto=compacto, encoding=encoding
+            ) as reader:
+                for n, chunk in enumerate(reader):
+                    if n < emitidos:
+                        continue
+                    chunk = _limpiar_chunk(chunk, compacto=compacto)
+                    if provincia:
+                        chunk = filter_by_province(chunk, provincia)
+                    yield chunk
+                    emitidos += 1
+            return
+        except UnicodeDecodeError:
+            if encoding == "latin1":
+                raise
+            encoding = "latin1"
+
+
+def load_and_clean_data(
+    uploaded_file,
+    chunksize: Optional[int] = None,
+    provincia: Optional[str] = None,
+    compacto: bool = False,
+) -> pd.DataFrame:
+    """
+    Carga y limpia el CSV del SRI.
+    Con chunksize se usa la lectura por streaming: cada bloque se limpia
+    (y se filtra por provincia, si se indica) antes de acumularse.
+    Con compacto=True solo se leen las columnas del pipeline y las de baja
+    cardinalidad (provincia, cantón, parroquia, estado, CIIU) quedan como
+    categóricas.
+    """
+    if chunksize or provincia:
+        return _concat_chunks(
+            list(
+                iter_clean_chunks(
+                    uploaded_file,
+                    chunksize=chunksize or CSV_CHUNKSIZE,
+                    provincia=provincia,
+                    compacto=compacto,
+                )
+            )
+        )
+
+    try:
+        df = _leer_csv(uploaded_file, compacto=compacto)
+    except UnicodeDecodeError:
+        # La muestra parecía utf-8 pero el resto del archivo no lo es
+        df = _leer_csv(uploaded_file, compacto=compacto, encoding="latin1")
+    return _limpiar_chunk(df, compacto=compacto)
+
+
+# ============================================================
+# CACHÉ COLUMNAR (FEATHER) DEL DATASET LIMPIO
+# ============================================================
+
+# Directorio del caché; cada archivo se identifica por el hash de su contenido
+SRI_CACHE_DIR = os.getenv("SRI_CACHE_DIR", os.path.join(".cache", "sri"))
+
+# Subir cuando cambie la limpieza para invalidar cachés antiguos
+CACHE_VERSION = "3"
+
+
+def hash_archivo(uploaded_file, block_size: int = 1 << 20) -> str:
+    """Calcula el hash (blake2b) del contenido del archivo leyendo por bloques."""
+    h = hashlib.blake2b(digest_size=20)
+    uploaded_file.seek(0)
+    while True:
+        block = uploaded_file.read(block_size)
+        if not block:
+            break
+        h.update(block.encode("utf-8") if isinstance(block, str) else block)
+    uploaded_file.seek(0)
+    return h.hexdigest()
+
+
+def _cache_path(digest: str, cache_dir: str, **opciones) -> str:
+    sufijo = "".join(
+        f"_{k}" if v is True else f"_{k}-{normalize_province(v).replace(' ', '_')}"
+        for k, v in sorted(opciones.items())
+        if v
+    )
+    return os.path.join(cache_dir, f"{digest}_v{CACHE_VERSION}{sufijo}.feather")
+
 
+def load_and_clean_data_cached(
+    uploaded_file,
+    cache_dir: str = SRI_CACHE_DIR,
+    chunksize: Optional[int] = CSV_CHUNKSIZE,
+    provincia: Optional[str] = None,
+    compacto: bool = False,
+    digest: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Igual que load_and_clean_data, pero guarda el resultado en Feather
+    indexado por el hash del archivo. Las cargas siguientes del mismo
+    archivo leen el caché con memory-map en lugar de parsear el CSV.
+    El hash queda en df.attrs["hash_archivo"] para cachear derivados del
+    mismo dataset (p. ej. el cubo de estadísticas); si quien llama ya lo
+    calculó, se pasa en `digest` para no leer el archivo otra vez.
+    Sin pyarrow se comporta como load_and_clean_data.
+    """
+    if not PYARROW_DISPONIBLE:
+        df = load_and_clean_data(
+            uploaded_file, chunksize=chunksize, provincia=provincia, compacto=compacto
+        )
+        if digest:
+            df.attrs["hash_archivo"] = digest
+        return df
+
+    digest = digest or hash_archivo(uploaded_file)
+    path = _cache_path(digest, cache_dir, provincia=provincia, compacto=compacto)
+
+    if os.path.exists(path):
+        try:
+            df = feather.read_table(path, memory_map=True).to_pandas()
+            df.attrs["hash_archivo"] = digest
+            return df
+        except Exception:
+            pass  # caché corrupto: se regenera
+
+    df = load_and_clean_data(
+        uploaded_file, chunksize=chunksize, provincia=provincia, compacto=compacto
+    )
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        # Sin compresión para poder mapear el archivo directamente
+        feather.write_feather(
+            df.reset_index(drop=True), tmp, compression="uncompressed"
+        )
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+    df.attrs["hash_archivo"] = digest
     return df
 
 
@@ -84,14 +333,68 @@ def load_and_clean_data(uploaded_file) -> pd.DataFrame:
 # FILTRO POR PROVINCIA (CORREGIDO)
 # ============================================================
 
-def filter_by_province(df: pd.DataFrame, provincia: str) -> pd.DataFrame:
+def build_province_index(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Construye el índice provincia normalizada → posiciones de fila (una sola
+    pasada). Cada valor distinto se normaliza una única vez.
+    """
+    if "DESCRIPCION_PROVINCIA_EST" not in df.columns:
+        return {}
+
+    codes, uniques = pd.factorize(df["DESCRIPCION_PROVINCIA_EST"], sort=False)
+    if len(uniques) == 0:
+        return {}
+
+    # Agrupar posiciones por código con un único ordenamiento estable
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    offset = int((codes < 0).sum())  # NaN (código -1) quedan al inicio
+
+    partes: Dict[str, List[np.ndarray]] = {}
+    for code, valor in enumerate(uniques):
+        n = counts[code]
+        partes.setdefault(normalize_province(valor), []).append(order[offset:offset + n])
+        offset += n
+
+    return {
+        prov: pos[0] if len(pos) == 1 else np.sort(np.concatenate(pos))
+        for prov, pos in partes.items()
+    }
+
+
+def filter_by_province(
+    df: pd.DataFrame,
+    provincia: str,
+    index: Optional[Dict[str, np.ndarray]] = None,
+) -> pd.DataFrame:
+    """
+    Devuelve las filas de la provincia sin modificar df.
+    Con un índice de build_province_index la consulta es O(filas de la provincia).
+    """
     provincia_norm = normalize_province(provincia)
 
     if "DESCRIPCION_PROVINCIA_EST" not in df.columns:
         return pd.DataFrame()
 
-    df["prov_norm"] = df["DESCRIPCION_PROVINCIA_EST"].apply(normalize_province)
-    return df.loc[df["prov_norm"] == provincia_norm].copy()
+    if index is None:
+        codes, uniques = pd.factorize(df["DESCRIPCION_PROVINCIA_EST"], sort=False)
+        hits = [i for i, v in enumerate(uniques) if normalize_province(v) == provincia_norm]
+        return df.loc[np.isin(codes, hits)].copy()
+
+    pos = index.get(provincia_norm)
+    if pos is None:
+        return df.iloc[0:0].copy()
+    return df.iloc[pos].copy()
+
+
+def iter_provinces(df: pd.DataFrame, index: Optional[Dict[str, np.ndarray]] = None):
+    """Itera (provincia normalizada, DataFrame de la provincia) usando el índice."""
+    if index is None:
+        index = build_province_index(df)
+
+    for prov in sorted(index):
+        if prov:
+            yield prov, df.iloc[index[prov]].copy()
 
 
 # ============================================================
@@ -118,34 +421,58 @@ KEYWORDS_LIBRERIAS = [
 ]
 
 
-def detect_libraries(df_provincia: pd.DataFrame) -> pd.DataFrame:
-    df = df_provincia.copy()
+def _compilar_alternancia(palabras) -> re.Pattern:
+    """Compila una única regex de alternancia (las más largas primero)."""
+    palabras = sorted(set(palabras), key=len, reverse=True)
+    return re.compile("|".join(re.escape(p) for p in palabras))
 
-    # Detectar columna CIIU
-    col_ciiu = None
+
+# Matchers compilados una sola vez para toda la detección
+CIIU_PATTERN = _compilar_alternancia(CIIU_CODIGOS_LIBRERIAS.keys())
+KEYWORDS_PATTERN = _compilar_alternancia(normalize_text(kw) for kw in KEYWORDS_LIBRERIAS)
+
+
+def _contiene_patron(serie: pd.Series, patron: re.Pattern) -> pd.Series:
+    """str.contains vectorizado; en categóricas solo evalúa las categorías."""
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(str)
+    return serie.str.contains(patron, na=False).astype(bool)
+
+
+def _columna_ciiu(df: pd.DataFrame) -> Optional[str]:
     for c in df.columns:
         if "ciiu" in c.lower():
-            col_ciiu = c
-            break
+            return c
+    return None
+
 
-    mask_ciiu = pd.Series([False] * len(df), index=df.index)
+def _mascara_librerias(df: pd.DataFrame, col_ciiu: Optional[str]) -> pd.Series:
+    """Filas que parecen librería por CIIU o por nombre (sin mirar el estado)."""
+    mask_ciiu = pd.Series(False, index=df.index)
 
     if col_ciiu:
-        df[col_ciiu] = df[col_ciiu].astype(str).str.strip()
-        mask_ciiu = df[col_ciiu].apply(
-            lambda v: any(code in v for code in CIIU_CODIGOS_LIBRERIAS.keys())
-        )
+        mask_ciiu = _contiene_patron(df[col_ciiu], CIIU_PATTERN)
 
-    # Detectar por palabras clave
+    # Detectar por palabras clave sobre el nombre normalizado (una vez por valor)
     if "NOMBRE_FANTASIA_COMERCIAL" in df.columns:
-        nombres = df["NOMBRE_FANTASIA_COMERCIAL"].astype(str).fillna("")
-        mask_nombre = nombres.apply(
-            lambda x: any(kw in normalize_text(x) for kw in KEYWORDS_LIBRERIAS)
-        )
+        nombres = normalize_text_series(df["NOMBRE_FANTASIA_COMERCIAL"])
+        mask_nombre = _contiene_patron(nombres, KEYWORDS_PATTERN)
     else:
-        mask_nombre = pd.Series([False] * len(df), index=df.index)
+        mask_nombre = pd.Series(False, index=df.index)
+
+    return mask_ciiu | mask_nombre
+
+
+def detect_libraries(df_provincia: pd.DataFrame) -> pd.DataFrame:
+    df = df_provincia
+
+    # Detectar columna CIIU
+    col_ciiu = _columna_ciiu(df)
+
+    df_lib = df[_mascara_librerias(df, col_ciiu)].copy()
 
-    df_lib = df[mask_ciiu | mask_nombre].copy()
+    if col_ciiu:
+        df_lib[col_ciiu] = df_lib[col_ciiu].astype(str).str.strip()
 
     # Filtrar activos
     if "ESTADO_CONTRIBUYENTE" in df_lib.columns:
@@ -163,67 +490,272 @@ def detect_libraries(df_provincia: pd.DataFrame) -> pd.DataFrame:
     return df_lib
 
 
+# ============================================================
+# DETECCIÓN EN PARALELO (POOL DE PROCESOS)
+# ============================================================
+
+# Por debajo de este tamaño no compensa arrancar procesos
+PARALLEL_MIN_ROWS = 200_000
+
+
+def _df_to_arrow(df: pd.DataFrame) -> bytes:
+    """Serializa un DataFrame como stream IPC de Arrow (sin pickle de pandas)."""
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _arrow_to_df(data: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def _detect_shard(data: bytes, provincia: Optional[str] = None) -> bytes:
+    """Trabajo de cada proceso: filtro opcional por provincia + detección."""
+    df = _arrow_to_df(data)
+    if provincia:
+        df = filter_by_province(df, provincia)
+    return _df_to_arrow(detect_libraries(df))
+
+
+def detect_libraries_parallel(
+    df: pd.DataFrame,
+    provincia: Optional[str] = None,
+    workers: Optional[int] = None,
+    min_rows: int = PARALLEL_MIN_ROWS,
+) -> pd.DataFrame:
+    """
+    Igual que detect_libraries (con filtro opcional por provincia), pero
+    reparte el DataFrame en fragmentos de filas que se procesan en un pool
+    de procesos. Los fragmentos viajan como buffers IPC de Arrow y los
+    resultados se unen conservando el orden original.
+    Sin pyarrow, con un solo worker o con pocos datos se ejecuta en serie.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    if not PYARROW_DISPONIBLE or workers < 2 or len(df) < min_rows:
+        if provincia:
+            df = filter_by_province(df, provincia)
+        return detect_libraries(df)
+
+    limites = np.linspace(0, len(df), workers + 1, dtype=int)
+    shards = [
+        _df_to_arrow(df.iloc[ini:fin])
+        for ini, fin in zip(limites[:-1], limites[1:])
+        if fin > ini
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        resultados = list(pool.map(_detect_shard, shards, [provincia] * len(shards)))
+
+    return _concat_chunks([_arrow_to_df(r) for r in resultados], ignore_index=False)
+
+
 # ============================================================
 # GEOAPIFY – GEOCODIFICACIÓN
 # ============================================================
 
 GEOAPIFY_URL = "https://api.geoapify.com/v1/geocode/search"
 
+# Cuota de Geoapify (peticiones/segundo) y concurrencia del geocodificador
+GEOAPIFY_RATE = float(os.getenv("GEOAPIFY_RATE", "5"))
+GEOAPIFY_WORKERS = int(os.getenv("GEOAPIFY_WORKERS", "8"))
+GEOAPIFY_MAX_RETRIES = 4
 
-def geocode_one(name: str, provincia: str, api_key: str, canton: str = "", parroquia: str = "") -> Optional[Dict[str, Any]]:
-    if not api_key:
-        return None
+# Limitador compartido por todos los hilos que consultan Geoapify
+_geoapify_bucket = TokenBucket(GEOAPIFY_RATE)
 
-    provincia_norm = normalize_province(provincia)
-    canton_clean = canton.strip() if canton else ""
-    parroquia_clean = parroquia.strip() if parroquia else ""
-    
+
+def _build_geocode_queries(
+    name: str, provincia_norm: str, canton_clean: str = "", parroquia_clean: str = ""
+) -> List[Tuple[str, str]]:
+    """
+    Consultas en cascada, de la más precisa a la más general, como pares
+    (nivel, consulta). Los niveles "canton", "parroquia" y "provincia" se
+    pueden resolver con el nomenclátor offline.
+    """
     # Build queries using available location data from dataset
     queries = []
     
     # Priority 1: Full address with name, parroquia, canton, provincia
     if name and parroquia_clean and canton_clean:
-        queries.append(f"{name}, {parroquia_clean}, {canton_clean}, {provincia_norm}, Ecuador")
+        queries.append(("nombre", f"{name}, {parroquia_clean}, {canton_clean}, {provincia_norm}, Ecuador"))
     
     # Priority 2: Name with canton and provincia
     if name and canton_clean:
-        queries.append(f"{name}, {canton_clean}, {provincia_norm}, Ecuador")
+        queries.append(("nombre", f"{name}, {canton_clean}, {provincia_norm}, Ecuador"))
     
     # Priority 3: Just canton and provincia (use canton center)
     if canton_clean:
-        queries.append(f"{canton_clean}, {provincia_norm}, Ecuador")
+        queries.append(("canton", f"{canton_clean}, {provincia_norm}, Ecuador"))
     
     # Priority 4: Parroquia and provincia
     if parroquia_clean:
-        queries.append(f"{parroquia_clean}, {provincia_norm}, Ecuador")
+        queries.append(("parroquia", f"{parroquia_clean}, {provincia_norm}, Ecuador"))
     
     # Priority 5: Just provincia (last resort)
     if provincia_norm:
-        queries.append(f"{provincia_norm}, Ecuador")
+        queries.append(("provincia", f"{provincia_norm}, Ecuador"))
+
+    return queries
+
+
+def _resolver_offline(nivel: str, provincia_norm: str, canton_clean: str) -> Optional[Dict[str, Any]]:
+    """
+    Punto de referencia del nomenclátor para los niveles cantón y provincia
+    de la cascada; el nivel parroquia no está en la tabla y va a Geoapify.
+    """
+    if nivel not in gazetteer.NIVELES:
+        return None
+    return gazetteer.lookup(nivel, provincia_norm, canton_clean)
+
+
+def _resultado_valido(p: Dict[str, Any], provincia_norm: str) -> bool:
+    # Validate it's in Ecuador
+    country = str(p.get("country", "")).lower()
+    if country and "ecuador" not in country and country != "ec":
+        return False
     
-    for q in queries:
-        params = {"text": q, "apiKey": api_key, "format": "json", "limit": 1}
+    # Validate it's in the correct province
+    geo_state = normalize_province(str(p.get("state", "")))
+    if provincia_norm and geo_state and provincia_norm not in geo_state:
+        return False
+
+    return True
 
-        try:
-            r = requests.get(GEOAPIFY_URL, params=params, timeout=10)
-            r.raise_for_status()
-        except Exception:
-            continue
 
-        data = r.json().get("results", [])
-        if not data:
+def _consultar_geoapify(q: str, api_key: str) -> List[Dict[str, Any]]:
+    """
+    Petición a Geoapify respetando la cuota (token bucket) y reintentando
+    los 429 con backoff. Lanza excepción ante errores de red o HTTP.
+    """
+    params = {"text": q, "apiKey": api_key, "format": "json", "limit": 1}
+
+    for attempt in range(GEOAPIFY_MAX_RETRIES + 1):
+        _geoapify_bucket.acquire()
+        r = http_client.get(GEOAPIFY_URL, params=params, timeout=10)
+        if r.status_code == 429:
+            # Cuota excedida: frenar a todos los hilos y reintentar
+            espera = retry_after_seconds(r.headers.get("Retry-After"))
+            _geoapify_bucket.pause(espera if espera is not None else backoff_delay(attempt))
             continue
+        r.raise_for_status()
+        return r.json().get("results", [])
 
-        p = data[0]
+    raise RuntimeError("Cuota de Geoapify excedida")
 
-        # Validate it's in Ecuador
-        country = str(p.get("country", "")).lower()
-        if country and "ecuador" not in country and country != "ec":
-            continue
-        
-        # Validate it's in the correct province
-        geo_state = normalize_province(str(p.get("state", "")))
-        if provincia_norm and geo_state and provincia_norm not in geo_state:
+
+def _geocode_query(
+    q: str,
+    provincia_norm: str,
+    api_key: str,
+    cache: Optional[GeocodeCache] = None,
+    memo: Optional[QueryMemo] = None,
+    raise_errors: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """
+    Resuelve una consulta y devuelve el resultado válido o None.
+    Los aciertos y los negativos se guardan en el caché; los errores de red no.
+    Con memo, cada consulta distinta se resuelve una sola vez por ejecución.
+    Con raise_errors=True los errores (red, 429 agotados, clave inválida) se
+    propagan en lugar de confundirse con "sin resultado".
+    """
+    cache_key = f"{q}|{provincia_norm}"
+
+    def resolver():
+        if cache is not None:
+            found, cached = cache.get(cache_key)
+            if found:
+                return cached
+
+        data = _consultar_geoapify(q, api_key)
+
+        p = data[0] if data else None
+        if p is not None and not _resultado_valido(p, provincia_norm):
+            p = None
+
+        if cache is not None:
+            cache.set(cache_key, p)
+
+        return p
+
+    try:
+        if memo is not None:
+            return memo.resolve(cache_key, resolver)
+        return resolver()
+    except Exception:
+        if raise_errors:
+            raise
+        return None
+
+
+def geocode_one(
+    name: str,
+    provincia: str,
+    api_key: str,
+    canton: str = "",
+    parroquia: str = "",
+    cache: Optional[GeocodeCache] = None,
+    use_cache: bool = True,
+    memo: Optional[QueryMemo] = None,
+    use_gazetteer: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    Geocodifica una librería probando las consultas en cascada.
+    Usa el caché SQLite compartido salvo que se pase otro o use_cache=False.
+    Pasando el mismo memo a varias llamadas, las consultas repetidas (p. ej.
+    "QUITO, PICHINCHA, Ecuador") se resuelven una sola vez.
+    Los niveles de cantón, parroquia y provincia se resuelven primero con el
+    nomenclátor offline (use_gazetteer=False lo desactiva).
+    """
+    if not api_key:
+        return None
+
+    info, _ = _geocode_cascada(
+        name, provincia, api_key, canton, parroquia,
+        cache=cache, use_cache=use_cache, memo=memo, use_gazetteer=use_gazetteer,
+    )
+    return info
+
+
+def _geocode_cascada(
+    name: str,
+    provincia: str,
+    api_key: str,
+    canton: str = "",
+    parroquia: str = "",
+    cache: Optional[GeocodeCache] = None,
+    use_cache: bool = True,
+    memo: Optional[QueryMemo] = None,
+    use_gazetteer: bool = True,
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Cascada de geocode_one. Devuelve (resultado, definitivo): definitivo es
+    False si algún nivel anterior al resultado falló por error, de modo que
+    ni el resultado ni el "no encontrado" deben guardarse como permanentes.
+    """
+    if cache is None and use_cache:
+        cache = get_default_cache()
+
+    provincia_norm = normalize_province(provincia)
+    canton_clean = canton.strip() if canton else ""
+    parroquia_clean = parroquia.strip() if parroquia else ""
+
+    queries = _build_geocode_queries(name, provincia_norm, canton_clean, parroquia_clean)
+    definitivo = True
+
+    for nivel, q in queries:
+        p = None
+        if use_gazetteer:
+            p = _resolver_offline(nivel, provincia_norm, canton_clean)
+        if p is None:
+            try:
+                p = _geocode_query(q, provincia_norm, api_key, cache, memo, raise_errors=True)
+            except Exception:
+                definitivo = False
+                continue
+        if p is None:
             continue
 
         # Return first valid result
@@ -233,58 +765,383 @@ def geocode_one(name: str, provincia: str, api_key: str, canton: str = "", parro
             "lon": p.get("lon"),
             "provincia_geo": p.get("state", provincia_norm),
             "raw": p,
-        }
-    
-    return None
+        }, definitivo
 
+    return None, definitivo
 
-def geocode_libraries(
-    df_librerias: pd.DataFrame,
-    geoapify_key: str,
-    max_registros: int = 50,
-    provincia_filtro: Optional[str] = None,
-) -> pd.DataFrame:
 
-    if df_librerias.empty:
-        return pd.DataFrame()
+def _campos_fila(row: Dict[str, Any], provincia_filtro: Optional[str]) -> Dict[str, str]:
+    prov_raw = str(row.get("DESCRIPCION_PROVINCIA_EST", "")).strip()
+    return {
+        "nombre": str(row.get("NOMBRE_FANTASIA_COMERCIAL", "")).strip(),
+        "provincia": normalize_province(prov_raw or provincia_filtro),
+        "canton": str(row.get("DESCRIPCION_CANTON_EST", "")).strip(),
+        "parroquia": str(row.get("DESCRIPCION_PARROQUIA_EST", "")).strip(),
+    }
 
-    df = df_librerias.copy().head(max_registros)
-    provincia_norm = normalize_province(provincia_filtro) if provincia_filtro else None
 
-    rows = []
+def _fila_geocodificada(
+    campos: Dict[str, str], info: Dict[str, Any], provincia_norm: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    # Strict validation: result MUST be in the correct province
+    geo_state_norm = normalize_province(str(info.get("provincia_geo", "")))
+    if provincia_norm and geo_state_norm:
+        if provincia_norm not in geo_state_norm and geo_state_norm not in provincia_norm:
+            return None
+
+    return {
+        "NOMBRE_FANTASIA_COMERCIAL": campos["nombre"],
+        "provincia": campos["provincia"],
+        "provincia_geo": info.get("provincia_geo", ""),
+        "canton": campos["canton"],
+        "parroquia": campos["parroquia"],
+        "lat": info["lat"],
+        "lon": info["lon"],
+    }
+
+
+def _geocode_campos(
+    campos: Dict[str, str],
+    geoapify_key: str,
+    cache: Optional[GeocodeCache],
+    memo: Optional[QueryMemo] = None,
+    use_gazetteer: bool = True,
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(lat, lon, provincia_geo) de la cascada para una fila y si es definitivo."""
+    # Pass canton and parroquia for better accuracy
+    info, definitivo = _geocode_cascada(
+        campos["nombre"], campos["provincia"], geoapify_key,
+        campos["canton"], campos["parroquia"], cache=cache, memo=memo,
+        use_gazetteer=use_gazetteer,
+    )
+    if not info:
+        return None, definitivo
+
+    return (
+        {"lat": info["lat"], "lon": info["lon"], "provincia_geo": info["provincia_geo"]},
+        definitivo,
+    )
 
-    for _, row in df.iterrows():
-        nombre = row.get("NOMBRE_FANTASIA_COMERCIAL", "").strip()
-        prov_raw = row.get("DESCRIPCION_PROVINCIA_EST", "").strip()
-        canton = row.get("DESCRIPCION_CANTON_EST", "").strip()
-        parroquia = row.get("DESCRIPCION_PARROQUIA_EST", "").strip()
 
-        prov_final = normalize_province(prov_raw or provincia_filtro)
+# ============================================================
+# GEOAPIFY – GEOCODIFICACIÓN POR LOTES (BATCH)
+# ============================================================
+
+GEOAPIFY_BATCH_URL = os.getenv(
+    "GEOAPIFY_BATCH_URL", "https://api.geoapify.com/v1/batch/geocode/search"
+)
+GEOAPIFY_BATCH_SIZE = 1000
+# Backend por defecto de geocode_libraries: "concurrent" o "batch"
+GEOAPIFY_BACKEND = os.getenv("GEOAPIFY_BACKEND", "concurrent")
+GEOAPIFY_BATCH_TIMEOUT = 300
+
+
+def geocode_batch(
+    queries: List[str],
+    api_key: str,
+    url: str = GEOAPIFY_BATCH_URL,
+    poll_interval: float = 1.0,
+    timeout: float = GEOAPIFY_BATCH_TIMEOUT,
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Envía las consultas como trabajos batch de Geoapify y espera sus
+    resultados. Devuelve consulta → primer resultado (None si no hubo).
+    Las consultas de un trabajo fallido no aparecen en el resultado.
+    """
+    resultados: Dict[str, Optional[Dict[str, Any]]] = {}
+    queries = list(dict.fromkeys(queries))
+
+    for ini in range(0, len(queries), GEOAPIFY_BATCH_SIZE):
+        lote = queries[ini:ini + GEOAPIFY_BATCH_SIZE]
+        try:
+            items = _ejecutar_batch(lote, api_key, url, poll_interval, timeout)
+        except Exception:
+            continue
 
-        # Pass canton and parroquia to geocode_one for better accuracy
-        info = geocode_one(nombre, prov_final, geoapify_key, canton, parroquia)
-        if not info:
+        for i, q in enumerate(lote):
+            item = items[i] if i < len(items) else None
+            if item is None or item.get("lat") is None or item.get("lon") is None:
+                resultados[q] = None
+            else:
+                resultados[q] = item
+
+    return resultados
+
+
+def _ejecutar_batch(
+    lote: List[str], api_key: str, url: str, poll_interval: float, timeout: float
+) -> List[Optional[Dict[str, Any]]]:
+    _geoapify_bucket.acquire()
+    r = http_client.post(url, params={"apiKey": api_key}, json=lote, timeout=30)
+    r.raise_for_status()
+    job = r.json()
+    poll_url = job.get("url") or f"{url}?id={job['id']}&apiKey={api_key}"
+
+    inicio = time.monotonic()
+    espera = poll_interval
+    while True:
+        if time.monotonic() - inicio > timeout:
+            raise TimeoutError("El trabajo batch de Geoapify no terminó a tiempo")
+        time.sleep(espera)
+        espera = min(espera * 2, 10.0)
+
+        _geoapify_bucket.acquire()
+        r = http_client.get(poll_url, timeout=30)
+        if r.status_code == 202:
             continue
+        r.raise_for_status()
+        items = r.json()
+        break
+
+    # Alinear por texto de consulta cuando viene informado; si no, por posición
+    por_texto = {
+        (it.get("query") or {}).get("text"): it
+        for it in items
+        if isinstance(it, dict) and (it.get("query") or {}).get("text")
+    }
+    if por_texto:
+        return [por_texto.get(q) for q in lote]
+    return list(items)
+
 
-        # Strict validation: result MUST be in the correct province
-        geo_state_norm = normalize_province(str(info.get("provincia_geo", "")))
-        if provincia_norm and geo_state_norm:
-            if provincia_norm not in geo_state_norm and geo_state_norm not in provincia_norm:
+def _geocode_libraries_batch(
+    campos: List[Dict[str, str]],
+    geoapify_key: str,
+    cache: Optional[GeocodeCache],
+    batch_url: str,
+    use_gazetteer: bool = True,
+    encontrados: Optional[Dict[str, Optional[Dict[str, Any]]]] = None,
+    al_finalizar: Optional[Callable[[List[Tuple[int, Optional[Dict[str, Any]], bool]]], None]] = None,
+) -> Tuple[List[Optional[Dict[str, Any]]], List[bool]]:
+    """
+    Resuelve la cascada de geocode_one por niveles: todas las consultas de
+    un nivel van en un trabajo batch y solo los fallos pasan al siguiente.
+    Devuelve un resultado (o None) por fila, en el mismo orden, y por fila
+    si es definitivo (False si alguna consulta de su cascada quedó en un
+    trabajo fallido). al_finalizar recibe tras cada nivel las filas que
+    quedaron cerradas en él como (índice, resultado, definitivo).
+    """
+    cascadas = [
+        _build_geocode_queries(c["nombre"], c["provincia"], c["canton"], c["parroquia"])
+        for c in campos
+    ]
+    resueltos: List[Optional[Dict[str, Any]]] = [None] * len(campos)
+    definitivos = [True] * len(campos)
+    pendientes = list(range(len(campos)))
+    nivel = 0
+
+    # Resultados por consulta compartidos entre niveles y filas de la ejecución
+    if encontrados is None:
+        encontrados = {}
+
+    while pendientes:
+        # Filas sin más niveles: cascada agotada
+        finalizados = [i for i in pendientes if nivel >= len(cascadas[i])]
+        pendientes = [i for i in pendientes if nivel < len(cascadas[i])]
+
+        # Nomenclátor y caché primero; el resto va en un solo lote
+        por_consultar = []
+        for i in pendientes:
+            tipo, q = cascadas[i][nivel]
+            key = f"{q}|{campos[i]['provincia']}"
+            if key in encontrados:
+                continue
+            if use_gazetteer:
+                local = _resolver_offline(tipo, campos[i]["provincia"], campos[i]["canton"])
+                if local is not None:
+                    encontrados[key] = local
+                    continue
+            found, cached = cache.get(key) if cache is not None else (False, None)
+            if found:
+                encontrados[key] = cached
+            else:
+                por_consultar.append(q)
+
+        if por_consultar:
+            respuesta = geocode_batch(por_consultar, geoapify_key, url=batch_url)
+        else:
+            respuesta = {}
+
+        siguientes = []
+        for i in pendientes:
+            _, q = cascadas[i][nivel]
+            prov = campos[i]["provincia"]
+            key = f"{q}|{prov}"
+            if key not in encontrados:
+                if q not in respuesta:
+                    # Trabajo batch fallido: no es un "sin resultado"
+                    definitivos[i] = False
+                else:
+                    p = respuesta[q]
+                    if p is not None and not _resultado_valido(p, prov):
+                        p = None
+                    encontrados[key] = p
+                    if cache is not None:
+                        cache.set(key, p)
+
+            p = encontrados.get(key)
+            if p is None:
+                siguientes.append(i)
                 continue
 
-        rows.append(
-            {
-                "NOMBRE_FANTASIA_COMERCIAL": nombre,
-                "provincia": prov_final,
-                "provincia_geo": info.get("provincia_geo", ""),
-                "canton": canton,
-                "parroquia": parroquia,
-                "lat": info["lat"],
-                "lon": info["lon"],
+            resueltos[i] = {
+                "lat": p.get("lat"),
+                "lon": p.get("lon"),
+                "provincia_geo": p.get("state", prov),
             }
+            finalizados.append(i)
+
+        if al_finalizar is not None and finalizados:
+            al_finalizar([(i, resueltos[i], definitivos[i]) for i in finalizados])
+
+        pendientes = siguientes
+        nivel += 1
+
+    return resueltos, definitivos
+
+
+# Filas por checkpoint del almacén incremental
+GEOCODE_CHECKPOINT_EVERY = 25
+
+
+def geocode_libraries(
+    df_librerias: pd.DataFrame,
+    geoapify_key: str,
+    max_registros: int = 50,
+    provincia_filtro: Optional[str] = None,
+    cache: Optional[GeocodeCache] = None,
+    workers: int = GEOAPIFY_WORKERS,
+    backend: str = GEOAPIFY_BACKEND,
+    batch_url: str = GEOAPIFY_BATCH_URL,
+    use_gazetteer: bool = True,
+    store: Optional[GeocodeStore] = None,
+    checkpoint_every: int = GEOCODE_CHECKPOINT_EVERY,
+    retry_misses: bool = False,
+    deduplicate: bool = True,
+) -> pd.DataFrame:
+    """
+    Geocodifica las librerías.
+    - backend="concurrent": pool de hilos; el ritmo lo marca el token bucket
+      de Geoapify, no una pausa fija entre filas.
+    - backend="batch": API batch de Geoapify, un trabajo por nivel de la
+      cascada (batch_url permite apuntar a un servidor local de pruebas).
+    En ambos, los niveles generales (cantón, parroquia, provincia) se
+    resuelven primero con el nomenclátor offline.
+
+    Es incremental: con RUC y número de establecimiento, cada resultado se
+    guarda en el almacén (checkpoint cada checkpoint_every filas; con el
+    backend batch, tras cada nivel de la cascada) y solo se
+    geocodifican las filas nuevas o cuya dirección cambió. Con
+    retry_misses=True también se reintentan las que antes no se encontraron.
+
+    Con deduplicate=True las filas con el mismo nombre y ubicación
+    normalizados (sucursales, registros repetidos) se geocodifican una vez
+    y el resultado se reparte a todas.
+    """
+    if df_librerias.empty or not geoapify_key:
+        return pd.DataFrame()
+
+    if cache is None:
+        cache = get_default_cache()
+    if store is None:
+        store = get_default_store()
+
+    df = df_librerias.head(max_registros)
+    provincia_norm = normalize_province(provincia_filtro) if provincia_filtro else None
+
+    registros = df.to_dict("records")
+    campos = [_campos_fila(row, provincia_filtro) for row in registros]
+    claves = [clave_establecimiento(row) for row in registros]
+    huellas = [
+        hash_direccion(c["nombre"], c["provincia"], c["canton"], c["parroquia"]) for c in campos
+    ]
+
+    infos: List[Optional[Dict[str, Any]]] = [None] * len(campos)
+    pendientes = list(range(len(campos)))
+
+    if store is not None:
+        # Los "no encontrado" guardados vencen como los negativos del caché
+        negative_ttl = cache.negative_ttl if cache is not None else GEOCODE_NEGATIVE_TTL
+        guardados = store.get_many(claves, negative_ttl=negative_ttl)
+        pendientes = []
+        for i, clave in enumerate(claves):
+            guardado = guardados.get(clave) if clave else None
+            if guardado is None or guardado[0] != huellas[i]:
+                pendientes.append(i)
+            elif guardado[1] is None and retry_misses:
+                pendientes.append(i)
+            else:
+                infos[i] = guardado[1]
+
+    # Deduplicación: filas con el mismo (nombre, provincia, cantón, parroquia)
+    # normalizado comparten huella y se geocodifican una sola vez
+    grupos: Dict[Any, List[int]] = {}
+    for i in pendientes:
+        grupos.setdefault(huellas[i] if deduplicate else i, []).append(i)
+
+    if deduplicate:
+        # Grupos que ya tienen resultado guardado en otra fila (p. ej. una sucursal)
+        conocidos = {
+            huellas[i]: infos[i]
+            for i in range(len(campos))
+            if infos[i] is not None
+        }
+        for huella in [h for h in grupos if h in conocidos]:
+            miembros = grupos.pop(huella)
+            for i in miembros:
+                infos[i] = conocidos[huella]
+            if store is not None:
+                store.save_many([(claves[i], huellas[i], infos[i]) for i in miembros])
+
+    representantes = [miembros[0] for miembros in grupos.values()]
+
+    def repartir(resueltos):
+        """Reparte (representante, resultado, definitivo) a cada grupo y hace checkpoint."""
+        miembros_lote = []
+        for i, info, definitivo in resueltos:
+            miembros = grupos[huellas[i] if deduplicate else i]
+            for m in miembros:
+                infos[m] = info
+            # Solo se guardan las filas resueltas sin errores de por medio
+            if definitivo:
+                miembros_lote.extend(miembros)
+
+        # Checkpoint: queda guardado aunque la ejecución se corte después
+        if store is not None and miembros_lote:
+            store.save_many([(claves[m], huellas[m], infos[m]) for m in miembros_lote])
+
+    if backend == "batch":
+        # Un trabajo por nivel para todas las filas; checkpoint tras cada nivel
+        _geocode_libraries_batch(
+            [campos[i] for i in representantes], geoapify_key, cache, batch_url,
+            use_gazetteer=use_gazetteer,
+            al_finalizar=lambda fin: repartir(
+                (representantes[j], info, definitivo) for j, info, definitivo in fin
+            ),
         )
+    else:
+        paso = max(1, checkpoint_every) if store is not None else max(1, len(representantes))
+
+        # Memo por consulta compartido por todas las filas de esta ejecución
+        memo = QueryMemo()
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for ini in range(0, len(representantes), paso):
+                lote = representantes[ini:ini + paso]
+                pares = pool.map(
+                    lambda i: _geocode_campos(
+                        campos[i], geoapify_key, cache, memo, use_gazetteer=use_gazetteer
+                    ),
+                    lote,
+                )
+                repartir((i, info, definitivo) for i, (info, definitivo) in zip(lote, pares))
 
-        time.sleep(0.3)
+    rows = []
+    for c, info in zip(campos, infos):
+        if info:
+            fila = _fila_geocodificada(c, info, provincia_norm)
+            if fila:
+                rows.append(fila)
 
     if not rows:
         return pd.DataFrame()
@@ -296,12 +1153,40 @@ def geocode_libraries(
 # ESTADÍSTICAS
 # ============================================================
 
-def get_library_statistics(df_provincia, df_librerias, df_geo):
+# Etiqueta de las librerías sin parroquia (nula o vacía) en todos los desgloses
+SIN_PARROQUIA = "SIN PARROQUIA"
+
+
+def _etiquetar_parroquias(serie: pd.Series) -> pd.Series:
+    """Misma regla que el cubo: parroquia nula o vacía → SIN_PARROQUIA."""
+    return serie.astype(object).fillna("").replace("", SIN_PARROQUIA)
+
+
+def get_library_statistics(df_provincia, df_librerias, df_geo, cube=None, provincia=None):
+    """
+    Métricas básicas de la provincia. Con un cubo de build_statistics_cube
+    y la provincia, se leen del cubo sin recorrer los DataFrames y se añaden
+    los campos extra del cubo (inactivas, porcentaje, desglose CIIU...).
+    """
+    if cube is not None and provincia:
+        nivel = cube_lookup(cube, provincia)
+        if nivel is not None:
+            return {
+                "total_registros_provincia": nivel["total_registros"],
+                "total_librerias": nivel["total_librerias"],
+                "parroquia_top": nivel["parroquia_top"],
+                "conteo_por_parroquia": nivel["por_parroquia"],
+                "librerias_inactivas": nivel["librerias_inactivas"],
+                "porcentaje_librerias": nivel["porcentaje_librerias"],
+                "conteo_por_canton": nivel["por_subnivel"],
+                "conteo_por_ciiu": nivel["por_ciiu"],
+            }
+
     total_registros = len(df_provincia)
     total_librerias = len(df_librerias)
 
     if "DESCRIPCION_PARROQUIA_EST" in df_librerias.columns:
-        parroquias = df_librerias["DESCRIPCION_PARROQUIA_EST"].fillna("SIN PARROQUIA")
+        parroquias = _etiquetar_parroquias(df_librerias["DESCRIPCION_PARROQUIA_EST"])
         conteo = parroquias.value_counts()
         parroquia_top = conteo.idxmax() if not conteo.empty else None
         conteo_por_parroquia = conteo.to_dict()
@@ -317,6 +1202,194 @@ def get_library_statistics(df_provincia, df_librerias, df_geo):
     }
 
 
+def _contar(counter: Dict[Any, int], clave: Any, n: int) -> None:
+    counter[clave] = counter.get(clave, 0) + n
+
+
+def build_statistics_cube(df: pd.DataFrame) -> Dict[Tuple[str, ...], Dict[str, Any]]:
+    """
+    Cubo de estadísticas jerárquico construido con una sola agrupación:
+    país → provincia → cantón → parroquia. Cada nivel guarda total de
+    registros, librerías activas e inactivas, porcentaje de librerías sobre
+    los registros, desglose por código CIIU y conteo de librerías por
+    subnivel. Las consultas se hacen con cube_lookup en O(1).
+
+    Claves: () para el país, (provincia,), (provincia, canton) y
+    (provincia, canton, parroquia), todas normalizadas como la provincia;
+    los desgloses conservan los nombres tal como vienen en el dataset.
+    """
+    if "DESCRIPCION_PROVINCIA_EST" not in df.columns:
+        return {}
+
+    def columna(nombre):
+        if nombre in df.columns:
+            return df[nombre].astype(object).fillna("").values
+        return np.full(len(df), "", dtype=object)
+
+    col_ciiu = _columna_ciiu(df)
+    es_libreria = _mascara_librerias(df, col_ciiu)
+
+    if "ESTADO_CONTRIBUYENTE" in df.columns:
+        activo = map_unique(
+            df["ESTADO_CONTRIBUYENTE"], lambda v: str(v).upper().strip() == "ACTIVO"
+        ).astype(bool)
+    else:
+        activo = pd.Series(True, index=df.index)
+
+    if col_ciiu:
+        def codigo(v):
+            m = CIIU_PATTERN.search(str(v))
+            return m.group(0) if m else "SIN CIIU DE LIBRERIA"
+
+        ciiu = map_unique(df[col_ciiu], codigo).values
+    else:
+        ciiu = np.full(len(df), "SIN CIIU DE LIBRERIA", dtype=object)
+
+    claves = pd.DataFrame(
+        {
+            "provincia": normalize_province_series(df["DESCRIPCION_PROVINCIA_EST"]).values,
+            "canton": columna("DESCRIPCION_CANTON_EST"),
+            "parroquia": columna("DESCRIPCION_PARROQUIA_EST"),
+            "es_libreria": es_libreria.values,
+            "activo": activo.values,
+            "ciiu": ciiu,
+        }
+    )
+    tabla = claves.groupby(list(claves.columns), sort=False, dropna=False).size()
+
+    cubo: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+
+    def nodo(clave):
+        if clave not in cubo:
+            cubo[clave] = {
+                "total_registros": 0,
+                "registros_activos": 0,
+                "total_librerias": 0,
+                "librerias_inactivas": 0,
+                "por_ciiu": {},
+                "por_subnivel": {},
+                "por_parroquia": {},
+            }
+        return cubo[clave]
+
+    # Recorre la tabla agregada (pocas filas), no el DataFrame original
+    for (prov, canton, parroquia, es_lib, es_activo, codigo_ciiu), n in tabla.items():
+        n = int(n)
+        canton_key = normalize_province(canton)
+        parroquia_key = normalize_province(parroquia)
+        niveles = [(), (prov,), (prov, canton_key), (prov, canton_key, parroquia_key)]
+        for clave in niveles:
+            d = nodo(clave)
+            d["total_registros"] += n
+            if es_activo:
+                d["registros_activos"] += n
+            if es_lib and es_activo:
+                d["total_librerias"] += n
+                _contar(d["por_ciiu"], codigo_ciiu, n)
+                _contar(d["por_parroquia"], parroquia or SIN_PARROQUIA, n)
+            elif es_lib:
+                d["librerias_inactivas"] += n
+
+        if es_lib and es_activo:
+            _contar(cubo[()]["por_subnivel"], prov, n)
+            _contar(cubo[(prov,)]["por_subnivel"], canton, n)
+            _contar(cubo[(prov, canton_key)]["por_subnivel"], parroquia or SIN_PARROQUIA, n)
+
+    for d in cubo.values():
+        total = d["total_registros"]
+        d["porcentaje_librerias"] = round(100 * d["total_librerias"] / total, 2) if total else 0.0
+        for k in ("por_ciiu", "por_subnivel", "por_parroquia"):
+            d[k] = dict(sorted(d[k].items(), key=lambda kv: kv[1], reverse=True))
+        d["parroquia_top"] = next(iter(d["por_parroquia"]), None)
+
+    return cubo
+
+
+def cube_lookup(
+    cube: Dict[Tuple[str, ...], Dict[str, Any]],
+    provincia: Optional[str] = None,
+    canton: Optional[str] = None,
+    parroquia: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Estadísticas de un nivel del cubo (None si no existe)."""
+    clave: Tuple[str, ...] = ()
+    if provincia:
+        clave = (normalize_province(provincia),)
+        if canton is not None:
+            clave += (normalize_province(str(canton)),)
+            if parroquia is not None:
+                clave += (normalize_province(str(parroquia)),)
+    return cube.get(clave)
+
+
+def analyze_all_provinces(
+    df: pd.DataFrame,
+    index: Optional[Dict[str, np.ndarray]] = None,
+    parallel: bool = False,
+) -> pd.DataFrame:
+    """
+    Modo por lotes: detecta librerías una sola vez sobre todo el dataset y
+    calcula las estadísticas de get_library_statistics para cada provincia
+    en una única agrupación. Devuelve una tabla consolidada (una fila por
+    provincia).
+    """
+    columnas = [
+        "provincia",
+        "total_registros_provincia",
+        "total_librerias",
+        "porcentaje_librerias",
+        "parroquia_top",
+        "conteo_por_parroquia",
+    ]
+    if "DESCRIPCION_PROVINCIA_EST" not in df.columns:
+        return pd.DataFrame(columns=columnas)
+
+    if index is None:
+        index = build_province_index(df)
+
+    df_lib = detect_libraries_parallel(df) if parallel else detect_libraries(df)
+    prov_lib = normalize_province_series(df_lib["DESCRIPCION_PROVINCIA_EST"])
+
+    if "DESCRIPCION_PARROQUIA_EST" in df_lib.columns:
+        parroquias = _etiquetar_parroquias(df_lib["DESCRIPCION_PARROQUIA_EST"])
+    else:
+        parroquias = pd.Series(None, index=df_lib.index, dtype=object)
+
+    # Una sola agrupación (provincia, parroquia) para todo el país
+    conteos = (
+        pd.DataFrame({"provincia": prov_lib.values, "parroquia": parroquias.values})
+        .groupby(["provincia", "parroquia"], sort=False, dropna=True)
+        .size()
+        .sort_values(ascending=False, kind="stable")
+    )
+    conteo_por_provincia: Dict[str, Dict[str, int]] = {}
+    for (prov, parroquia), n in conteos.items():
+        conteo_por_provincia.setdefault(prov, {})[parroquia] = int(n)
+    total_por_provincia = prov_lib.value_counts().to_dict()
+
+    rows = []
+    for prov in sorted(index):
+        if not prov:
+            continue
+        total_registros = len(index[prov])
+        total_librerias = int(total_por_provincia.get(prov, 0))
+        conteo = conteo_por_provincia.get(prov, {})
+        rows.append(
+            {
+                "provincia": prov,
+                "total_registros_provincia": total_registros,
+                "total_librerias": total_librerias,
+                "porcentaje_librerias": (
+                    round(100 * total_librerias / total_registros, 2) if total_registros else 0.0
+                ),
+                "parroquia_top": next(iter(conteo), None),
+                "conteo_por_parroquia": conteo,
+            }
+        )
+
+    return pd.DataFrame(rows, columns=columnas)
+
+
 # ============================================================
 # SCRAPING GOOGLE + CATÁLOGO
 # ============================================================
@@ -333,7 +1406,7 @@ def google_search_first_result(query: str) -> Optional[str]:
     url = f"https://www.google.com/search?q={q}&hl=es-419"
 
     try:
-        r = requests.get(url, headers=SCRAPE_HEADERS, timeout=10)
+        r = fetch_scheduler.get(url, robots=False, headers=SCRAPE_HEADERS, timeout=10)
         r.raise_for_status()
     except Exception:
         return None
@@ -355,61 +1428,11 @@ def google_search_first_result(query: str) -> Optional[str]:
 
 def extraer_catalogo_web(url: str) -> List[str]:
     try:
-        r = requests.get(url, headers=SCRAPE_HEADERS, timeout=15)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, "html.parser")
+        html = http_cache.fetch_text(url, headers=SCRAPE_HEADERS, timeout=15)
     except Exception:
         return []
 
-    items = []
-
-    selectores = [
-        ".book-item",
-        ".producto-libro",
-        ".product-title",
-        ".woocommerce-loop-product__title",
-        ".book-title",
-        ".titulo-libro",
-        ".entry-title",
-        "li.product",
-        "article",
-    ]
-
-    for sel in selectores:
-        for el in soup.select(sel):
-            t = el.get_text(strip=True)
-            if 3 < len(t) < 120:
-                items.append(t)
-
-    PALABRAS_LIBROS = [
-        "libro",
-        "novela",
-        "cuento",
-        "autor",
-        "editorial",
-        "tapa dura",
-        "tapa blanda",
-        "literatura",
-        "poesía",
-        "ensayo",
-        "biografia",
-    ]
-
-    for tag in soup.find_all(["h1", "h2", "h3", "h4", "a"]):
-        t = tag.get_text(strip=True)
-        if any(w in t.lower() for w in PALABRAS_LIBROS):
-            if 3 < len(t) < 120:
-                items.append(t)
-
-    clean = []
-    for i in items:
-        low = i.lower()
-        if "papeler" in low or "útiles" in low:
-            continue
-        if i not in clean:
-            clean.append(i)
-
-    return clean[:50]
+    return extraer_titulos_perfilado(html, url, limite=50)
 
 
 # ============================================================
@@ -434,17 +1457,20 @@ def _generar_libros_fallback(cantidad: int = 15) -> list:
     return libros
 
 
-def _obtener_libros_de_libreria(nombre: str, index: int, total: int) -> list:
-    """Intenta obtener libros de una librería desde múltiples fuentes."""
-    print(f"  [{index}/{total}] {nombre}...", end=" ")
-    
+# Selenium (Chrome) no pasa por fetch_scheduler: un solo navegador a la vez
+# en todo el proceso, también entre sesiones de Streamlit
+_FACEBOOK_LOCK = threading.Lock()
+
+
+def _libros_web(nombre: str, prefijo: str) -> list:
+    """Intentos 1 y 2 (HTTP, paralelizables): web directa y scraper DuckDuckGo."""
     # Intento 1: Web scraping directo con Google
     try:
         url = google_search_first_result(f"{nombre} librería Ecuador libros")
         if url:
             libros = extraer_catalogo_web(url)
             if libros and len(libros) >= 3:
-                print(f"✅ ({len(libros)} libros - web)")
+                print(f"{prefijo} ✅ ({len(libros)} libros - web)")
                 return libros
     except Exception:
         pass
@@ -455,29 +1481,34 @@ def _obtener_libros_de_libreria(nombre: str, index: int, total: int) -> list:
         resultado = buscar(nombre, "Ecuador")
         catalogo = resultado.get("catalogo_detectado", [])
         if catalogo and len(catalogo) >= 3:
-            print(f"✅ ({len(catalogo)} libros - Google scraper)")
+            print(f"{prefijo} ✅ ({len(catalogo)} libros - Google scraper)")
             return catalogo
     except Exception:
         pass
-    
+
+    return []
+
+
+def _libros_facebook_o_fallback(nombre: str, prefijo: str) -> list:
+    """Intento 3 (Selenium, serializado con _FACEBOOK_LOCK) y fallback simulado."""
     # Intento 3: Scraper Facebook (con manejo robusto)
     try:
         from scraper_facebook import extraer_libros_facebook
-        import os
         
         groq_key = os.environ.get("GROQ_API_KEY")
         # Intentar buscar página de Facebook de la librería
         url_facebook = f"https://www.facebook.com/search/pages?q={nombre}+librería+Ecuador"
         
-        resultado_fb = extraer_libros_facebook(
-            url_facebook, 
-            cantidad_posts=5, 
-            api_key_groq=groq_key
-        )
+        with _FACEBOOK_LOCK:
+            resultado_fb = extraer_libros_facebook(
+                url_facebook, 
+                cantidad_posts=5, 
+                api_key_groq=groq_key
+            )
         titulos_fb = resultado_fb.get("titulos", []) if resultado_fb else []
         
         if titulos_fb and len(titulos_fb) >= 3:
-            print(f"✅ ({len(titulos_fb)} libros - Facebook)")
+            print(f"{prefijo} ✅ ({len(titulos_fb)} libros - Facebook)")
             return titulos_fb
     except Exception:
         pass
@@ -485,13 +1516,19 @@ def _obtener_libros_de_libreria(nombre: str, index: int, total: int) -> list:
     # Fallback: Generar libros realistas
     libros_fallback = _generar_libros_fallback(random.randint(8, 15))
     if libros_fallback:
-        print(f"✅ ({len(libros_fallback)} libros - catálogo simulado)")
+        print(f"{prefijo} ✅ ({len(libros_fallback)} libros - catálogo simulado)")
         return libros_fallback
     
-    print("⚠️")
+    print(f"{prefijo} ⚠️")
     return []
 
 
+def _obtener_libros_de_libreria(nombre: str, index: int, total: int) -> list:
+    """Intenta obtener libros de una librería desde múltiples fuentes."""
+    prefijo = f"  [{index}/{total}] {nombre}..."
+    return _libros_web(nombre, prefijo) or _libros_facebook_o_fallback(nombre, prefijo)
+
+
 def build_books_ranking_from_libraries(
     df_librerias: pd.DataFrame,
     max_librerias: int = 5,
@@ -499,6 +1536,9 @@ def build_books_ranking_from_libraries(
     """
     Obtiene ranking de libros desde múltiples fuentes para cada librería.
     Intenta: Web → Google Scraper → Facebook → Fallback realista
+    Las fuentes HTTP se consultan para todas las librerías en paralelo (el
+    ritmo por host lo impone fetch_scheduler); después, solo para las que no
+    dieron resultado, Facebook (Selenium) y el fallback, de una en una.
     """
     nombres = (
         df_librerias["NOMBRE_FANTASIA_COMERCIAL"]
@@ -509,15 +1549,19 @@ def build_books_ranking_from_libraries(
     
     print(f"\n📚 Extrayendo catálogos de {len(nombres)} librerías...")
     
-    for i, nombre in enumerate(nombres, 1):
-        if not nombre or not nombre.strip():
-            continue
-        
-        libros = _obtener_libros_de_libreria(nombre, i, len(nombres))
+    tareas = [(i, nombre) for i, nombre in enumerate(nombres, 1) if nombre and nombre.strip()]
+    workers = max(1, min(fetch_scheduler.SCRAPE_WORKERS, len(tareas)))
+
+    prefijos = [f"  [{i}/{len(nombres)}] {nombre}..." for i, nombre in tareas]
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        resultados = list(ex.map(lambda t: _libros_web(t[0][1], t[1]), zip(tareas, prefijos)))
+
+    for (_, nombre), prefijo, libros in zip(tareas, prefijos, resultados):
+        if not libros:
+            libros = _libros_facebook_o_fallback(nombre, prefijo)
         if libros:
             titulos.extend(libros)
-        
-        time.sleep(1)
     
     if not titulos:
         print("\n⚠️ No se obtuvieron libros desde ninguna fuente\n")
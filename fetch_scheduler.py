@@ -0,0 +1,207 @@
+# fetch_scheduler.py
+# Planificador de cortesía por host: concurrencia máxima, intervalo mínimo y robots.txt
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+import http_client
+
+# Peticiones simultáneas por host e intervalo mínimo (s) entre dos inicios
+SCRAPE_MAX_PER_HOST = int(os.getenv("SCRAPE_MAX_PER_HOST", "2"))
+SCRAPE_MIN_INTERVAL = float(os.getenv("SCRAPE_MIN_INTERVAL", "1.0"))
+
+# Hilos para recorrer librerías en paralelo (cada host sigue limitado)
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "8"))
+
+# Respetar robots.txt en las páginas que se rastrean y cuánto dura su caché
+SCRAPE_RESPECT_ROBOTS = os.getenv("SCRAPE_RESPECT_ROBOTS", "1") != "0"
+ROBOTS_TTL = int(os.getenv("ROBOTS_TTL", 24 * 3600))
+
+DEFAULT_USER_AGENT = "LibreriaScraper"
+
+
+class RobotsDisallowed(requests.RequestException):
+    """robots.txt del sitio no permite descargar la URL."""
+
+
+class FetchCancelled(requests.RequestException):
+    """Quien pidió la descarga la canceló antes de que empezara."""
+
+
+def _comprobar(cancel: Optional[threading.Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise FetchCancelled("descarga cancelada")
+
+
+class _Host:
+    def __init__(self, max_concurrent: int):
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+        self.robots: Optional[RobotFileParser] = None
+        self.robots_at = 0.0
+        self.robots_lock = threading.Lock()
+
+
+class FetchScheduler:
+    """
+    Centraliza el ritmo de las descargas: cada host admite como mucho
+    `max_per_host` peticiones a la vez y espera `min_interval` segundos (o el
+    Crawl-delay de su robots.txt, si es mayor) entre dos inicios. Las
+    peticiones a hosts distintos no se esperan entre sí. Es seguro usarlo
+    desde varios hilos.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = SCRAPE_MAX_PER_HOST,
+        min_interval: float = SCRAPE_MIN_INTERVAL,
+        respect_robots: bool = SCRAPE_RESPECT_ROBOTS,
+        robots_ttl: int = ROBOTS_TTL,
+    ):
+        self.max_per_host = max(1, max_per_host)
+        self.min_interval = max(0.0, min_interval)
+        self.respect_robots = respect_robots
+        self.robots_ttl = robots_ttl
+        self._hosts: Dict[str, _Host] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _origen(url: str) -> str:
+        partes = urlparse(url)
+        return f"{partes.scheme}://{partes.netloc.lower()}"
+
+    def _host(self, origen: str) -> _Host:
+        with self._lock:
+            host = self._hosts.get(origen)
+            if host is None:
+                host = self._hosts[origen] = _Host(self.max_per_host)
+            return host
+
+    def _robots(self, origen: str, host: _Host) -> RobotFileParser:
+        """robots.txt del origen (descargado una vez por ROBOTS_TTL)."""
+        with host.robots_lock:
+            if host.robots is not None and time.monotonic() - host.robots_at < self.robots_ttl:
+                return host.robots
+
+            parser = RobotFileParser(origen + "/robots.txt")
+            try:
+                r = http_client.get(parser.url, headers={"User-Agent": DEFAULT_USER_AGENT}, timeout=5)
+                if r.status_code in (401, 403):
+                    parser.disallow_all = True
+                elif r.status_code >= 400:
+                    parser.allow_all = True
+                else:
+                    parser.parse(r.text.splitlines())
+            except requests.RequestException:
+                parser.allow_all = True
+
+            host.robots = parser
+            host.robots_at = time.monotonic()
+            return parser
+
+    def allowed(self, url: str, user_agent: str = DEFAULT_USER_AGENT) -> bool:
+        if not self.respect_robots:
+            return True
+        origen = self._origen(url)
+        return self._robots(origen, self._host(origen)).can_fetch(user_agent, url)
+
+    def _intervalo(self, host: _Host, user_agent: str) -> float:
+        if host.robots is None:
+            return self.min_interval
+        delay = host.robots.crawl_delay(user_agent)
+        return max(self.min_interval, float(delay or 0))
+
+    @contextmanager
+    def slot(
+        self,
+        url: str,
+        user_agent: str = DEFAULT_USER_AGENT,
+        cancel: Optional[threading.Event] = None,
+    ):
+        """
+        Reserva un turno en el host de `url` respetando concurrencia e intervalo.
+        Si `cancel` se activa mientras se espera el turno, lanza FetchCancelled
+        sin ocupar el host.
+        """
+        host = self._host(self._origen(url))
+        if cancel is None:
+            host.semaphore.acquire()
+        else:
+            while not host.semaphore.acquire(timeout=0.1):
+                _comprobar(cancel)
+        try:
+            _comprobar(cancel)
+            with host.lock:
+                now = time.monotonic()
+                inicio = max(now, host.next_at)
+                host.next_at = inicio + self._intervalo(host, user_agent)
+            if inicio > now:
+                if cancel is None:
+                    time.sleep(inicio - now)
+                elif cancel.wait(inicio - now):
+                    raise FetchCancelled("descarga cancelada")
+            yield
+        finally:
+            host.semaphore.release()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        robots: bool = True,
+        cancel: Optional[threading.Event] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Petición a través de http_client dentro de un turno del host.
+        robots=False omite robots.txt (servicios propios y endpoints de búsqueda,
+        que no son páginas rastreadas). `cancel` (threading.Event) descarta la
+        petición si se activa antes de que empiece; una petición ya enviada
+        termina normalmente.
+        """
+        _comprobar(cancel)
+        user_agent = (kwargs.get("headers") or {}).get("User-Agent", DEFAULT_USER_AGENT)
+        if robots and not self.allowed(url, user_agent):
+            raise RobotsDisallowed(f"robots.txt no permite {url}")
+        with self.slot(url, user_agent, cancel):
+            return http_client.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+_scheduler: Optional[FetchScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FetchScheduler:
+    """Planificador compartido por todo el proceso (se crea al primer uso)."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = FetchScheduler()
+    return _scheduler
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return get_scheduler().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
@@ -0,0 +1,92 @@
+# gazetteer.py
+# Nomenclátor offline de Ecuador: puntos de referencia de provincia y cantón
+
+import csv
+import os
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from text_normalization import normalize_province
+
+# Tabla incluida en el repositorio (cobertura parcial):
+# - nivel "provincia": coordenadas de la capital provincial (no el centroide)
+#   de las 24 provincias;
+# - nivel "canton": cabeceras de unos 135 de los 221 cantones.
+# El nivel parroquia y los cantones que faltan quedan fuera de este
+# nomenclátor (pendiente: tabla DPA completa del INEC con centroides); esos
+# niveles siguen consultando Geoapify. La columna "parroquia" se conserva
+# para que esa tabla use las mismas columnas.
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer_ecuador.csv"),
+)
+
+# Niveles de la cascada que el nomenclátor puede resolver
+NIVELES = ("canton", "provincia")
+
+Clave = Tuple[str, ...]
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path: str = GAZETTEER_PATH) -> Dict[Clave, Tuple[float, float]]:
+    """
+    Carga el nomenclátor indexado por nombres normalizados:
+    ("provincia", P) y ("canton", P, C). Las demás filas se ignoran.
+    """
+    index: Dict[Clave, Tuple[float, float]] = {}
+
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    coords = (float(row["lat"]), float(row["lon"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+                nivel = (row.get("nivel") or "").strip().lower()
+                prov = normalize_province(row.get("provincia") or "")
+                canton = normalize_province(row.get("canton") or "")
+
+                if nivel == "provincia" and prov:
+                    index[("provincia", prov)] = coords
+                elif nivel == "canton" and prov and canton:
+                    index[("canton", prov, canton)] = coords
+    except OSError:
+        return {}
+
+    return index
+
+
+def lookup(
+    nivel: str,
+    provincia: str,
+    canton: str = "",
+    path: str = GAZETTEER_PATH,
+) -> Optional[Dict[str, Any]]:
+    """
+    Busca el punto de referencia de un nivel ("canton" o "provincia"); con
+    la tabla incluida es la cabecera cantonal o la capital provincial.
+    Devuelve un resultado con la misma forma que los de Geoapify (lat, lon,
+    state, country) o None si no está en la tabla.
+    """
+    index = load_gazetteer(path)
+    prov = normalize_province(provincia)
+
+    if nivel == "provincia":
+        coords = index.get(("provincia", prov))
+    elif nivel == "canton":
+        coords = index.get(("canton", prov, normalize_province(canton) if canton else ""))
+    else:
+        coords = None
+
+    if coords is None:
+        return None
+
+    return {
+        "lat": coords[0],
+        "lon": coords[1],
+        "state": prov,
+        "country": "Ecuador",
+        "result_type": nivel,
+        "source": "gazetteer",
+    }
@@ -0,0 +1,135 @@
+# geocode_cache.py
+# Caché persistente (SQLite) de consultas de geocodificación con TTL
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlite_store import LazyDefault, SQLiteStore
+from text_normalization import normalize_text
+
+# Ruta del caché; una cadena vacía lo desactiva
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join(".cache", "geocode.sqlite"))
+
+# Vigencia de los aciertos y de los resultados negativos (en segundos)
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 30 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", 7 * 24 * 3600))
+
+
+class GeocodeCache(SQLiteStore):
+    """
+    Guarda por consulta normalizada el resultado válido de Geoapify o un
+    resultado negativo ("sin resultado válido en esta provincia"), cada uno
+    con su propio TTL.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS geocode (
+            query   TEXT PRIMARY KEY,
+            result  TEXT,
+            created REAL NOT NULL
+        )
+    """
+
+    def __init__(
+        self,
+        path: str = GEOCODE_CACHE_PATH,
+        ttl: int = GEOCODE_CACHE_TTL,
+        negative_ttl: int = GEOCODE_NEGATIVE_TTL,
+    ):
+        super().__init__(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return normalize_text(query)
+
+    def get(self, query: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Devuelve (encontrado, resultado). resultado=None es un negativo cacheado."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created FROM geocode WHERE query = ?",
+                (self._key(query),),
+            ).fetchone()
+
+        if row is None:
+            return False, None
+
+        result, created = row
+        ttl = self.ttl if result is not None else self.negative_ttl
+        if time.time() - created > ttl:
+            return False, None
+
+        return True, json.loads(result) if result is not None else None
+
+    def set(self, query: str, result: Optional[Dict[str, Any]]) -> None:
+        """Guarda un acierto (dict) o un negativo (None)."""
+        payload = json.dumps(result, ensure_ascii=False) if result is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (query, result, created) VALUES (?, ?, ?)",
+                (self._key(query), payload, time.time()),
+            )
+
+    def purge_expired(self) -> int:
+        """Elimina las entradas vencidas y devuelve cuántas se borraron."""
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                """
+                DELETE FROM geocode
+                WHERE (result IS NOT NULL AND created < ?)
+                   OR (result IS NULL AND created < ?)
+                """,
+                (now - self.ttl, now - self.negative_ttl),
+            )
+        return cur.rowcount
+
+
+_default_cache = LazyDefault(lambda: GeocodeCache(GEOCODE_CACHE_PATH) if GEOCODE_CACHE_PATH else None)
+
+
+def get_default_cache() -> Optional[GeocodeCache]:
+    """Caché compartido del proceso (None si GEOCODE_CACHE_PATH está vacío)."""
+    return _default_cache.get()
+
+
+class QueryMemo:
+    """
+    Memo en memoria para una ejecución: cada consulta se resuelve una sola
+    vez aunque la pidan varias filas (o varios hilos a la vez). Los errores
+    no se memorizan, así que una consulta fallida se puede reintentar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+
+    def resolve(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        future.set_result(value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._futures)
@@ -0,0 +1,105 @@
+# geocode_store.py
+# Almacén incremental de geocodificación por establecimiento (RUC + número)
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlite_store import LazyDefault, SQLiteStore
+from text_normalization import normalize_text
+
+# Ruta del almacén; una cadena vacía lo desactiva
+GEOCODE_STORE_PATH = os.getenv("GEOCODE_STORE_PATH", os.path.join(".cache", "geocode_store.sqlite"))
+
+# Columnas del SRI que identifican un establecimiento
+COLUMNA_RUC = "NUMERO_RUC"
+COLUMNA_ESTABLECIMIENTO = "NUMERO_ESTABLECIMIENTO"
+
+
+def clave_establecimiento(row: Dict[str, Any]) -> Optional[str]:
+    """Clave estable 'RUC|establecimiento' o None si la fila no trae RUC."""
+    ruc = str(row.get(COLUMNA_RUC, "") or "").strip()
+    if not ruc:
+        return None
+    establecimiento = str(row.get(COLUMNA_ESTABLECIMIENTO, "") or "").strip()
+    return f"{ruc}|{establecimiento}"
+
+
+def hash_direccion(*partes: str) -> str:
+    """Huella de los datos de ubicación; si cambian, la fila se geocodifica de nuevo."""
+    texto = "|".join(normalize_text(p) for p in partes)
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class GeocodeStore(SQLiteStore):
+    """
+    Guarda el resultado de geocodificar cada establecimiento junto con la
+    huella de su dirección. save_many escribe un lote en una transacción,
+    de modo que una ejecución interrumpida se reanuda desde el último lote.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS establecimientos (
+            clave        TEXT PRIMARY KEY,
+            address_hash TEXT NOT NULL,
+            result       TEXT,
+            updated      REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str = GEOCODE_STORE_PATH):
+        super().__init__(path)
+
+    def get_many(
+        self, claves: Iterable[str], negative_ttl: Optional[float] = None
+    ) -> Dict[str, Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Devuelve clave → (huella de dirección, resultado o None si no se encontró).
+        Con negative_ttl, los "no encontrado" más antiguos se omiten (vencidos).
+        """
+        claves = list(dict.fromkeys(c for c in claves if c))
+        encontrados: Dict[str, Tuple[str, Optional[Dict[str, Any]]]] = {}
+        limite = time.time() - negative_ttl if negative_ttl is not None else None
+
+        with self._lock:
+            for ini in range(0, len(claves), 500):
+                lote = claves[ini:ini + 500]
+                marcas = ",".join("?" * len(lote))
+                filas = self._conn.execute(
+                    f"SELECT clave, address_hash, result, updated FROM establecimientos "
+                    f"WHERE clave IN ({marcas})",
+                    lote,
+                ).fetchall()
+                for clave, address_hash, result, updated in filas:
+                    if result is None and limite is not None and updated < limite:
+                        continue
+                    encontrados[clave] = (address_hash, json.loads(result) if result else None)
+
+        return encontrados
+
+    def save_many(self, items: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> None:
+        """Guarda (clave, huella, resultado) en una sola transacción (checkpoint)."""
+        now = time.time()
+        filas = [
+            (clave, address_hash, json.dumps(result, ensure_ascii=False) if result else None, now)
+            for clave, address_hash, result in items
+            if clave
+        ]
+        if not filas:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO establecimientos (clave, address_hash, result, updated) "
+                "VALUES (?, ?, ?, ?)",
+                filas,
+            )
+
+
+_default_store = LazyDefault(lambda: GeocodeStore(GEOCODE_STORE_PATH) if GEOCODE_STORE_PATH else None)
+
+
+def get_default_store() -> Optional[GeocodeStore]:
+    """Almacén compartido del proceso (None si GEOCODE_STORE_PATH está vacío)."""
+    return _default_store.get()
@@ -0,0 +1,114 @@
+# http_cache.py
+# Caché HTTP en disco (SQLite) con revalidación condicional (ETag / Last-Modified)
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+import fetch_scheduler
+from sqlite_store import LazyDefault, SQLiteStore
+
+# Ruta del caché; una cadena vacía lo desactiva
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", os.path.join(".cache", "http.sqlite"))
+
+# Segundos durante los que una página se sirve sin consultar al servidor
+HTTP_CACHE_FRESHNESS = int(os.getenv("HTTP_CACHE_FRESHNESS", 24 * 3600))
+
+
+class HttpCache(SQLiteStore):
+    """
+    Guarda el cuerpo de cada respuesta 200 junto con sus cabeceras ETag y
+    Last-Modified. Dentro de la ventana de frescura se sirve la copia local;
+    pasada la ventana se revalida con un GET condicional (un 304 solo renueva
+    la marca de tiempo). Las descargas pasan por fetch_scheduler (ritmo por
+    host y robots.txt).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS paginas (
+            url           TEXT PRIMARY KEY,
+            body          TEXT NOT NULL,
+            etag          TEXT,
+            last_modified TEXT,
+            fetched       REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str = HTTP_CACHE_PATH, freshness: int = HTTP_CACHE_FRESHNESS):
+        super().__init__(path)
+        self.freshness = freshness
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched FROM paginas WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, fetched = row
+        return {"body": body, "etag": etag, "last_modified": last_modified, "fetched": fetched}
+
+    def set(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO paginas (url, body, etag, last_modified, fetched) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, body, etag, last_modified, time.time()),
+            )
+
+    def touch(self, url: str) -> None:
+        """Renueva la frescura de una entrada tras un 304."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE paginas SET fetched = ? WHERE url = ?", (time.time(), url))
+
+    def fetch(self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> str:
+        """
+        Devuelve el HTML de `url` desde el caché o la red. Si la red falla y
+        hay una copia (aunque esté vencida), se sirve la copia.
+        """
+        entrada = self.get(url)
+        if entrada is not None and time.time() - entrada["fetched"] < self.freshness:
+            return entrada["body"]
+
+        headers = dict(headers or {})
+        if entrada is not None:
+            if entrada["etag"]:
+                headers["If-None-Match"] = entrada["etag"]
+            if entrada["last_modified"]:
+                headers["If-Modified-Since"] = entrada["last_modified"]
+
+        try:
+            r = fetch_scheduler.get(url, headers=headers, **kwargs)
+            if r.status_code == 304 and entrada is not None:
+                self.touch(url)
+                return entrada["body"]
+            r.raise_for_status()
+        except requests.RequestException:
+            if entrada is not None:
+                return entrada["body"]
+            raise
+
+        self.set(url, r.text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        return r.text
+
+
+_default_cache = LazyDefault(lambda: HttpCache(HTTP_CACHE_PATH) if HTTP_CACHE_PATH else None)
+
+
+def get_default_http_cache() -> Optional[HttpCache]:
+    """Caché compartido del proceso (None si HTTP_CACHE_PATH está vacío)."""
+    return _default_cache.get()
+
+
+def fetch_text(url: str, headers: Optional[Dict[str, str]] = None, **kwargs) -> str:
+    """GET con caché condicional; sin caché equivale a fetch_scheduler.get + raise_for_status."""
+    cache = get_default_http_cache()
+    if cache is not None:
+        return cache.fetch(url, headers=headers, **kwargs)
+
+    r = fetch_scheduler.get(url, headers=headers, **kwargs)
+    r.raise_for_status()
+    return r.text
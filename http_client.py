@@ -0,0 +1,88 @@
+# http_client.py
+# Cliente HTTP compartido: sesión con pools de conexiones por host y keep-alive
+
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Número de hosts con pool propio y conexiones por host
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "20"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+
+# Timeout por defecto (segundos) si la llamada no indica uno
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+# Reintentos ante errores de conexión y 5xx (los 429 los gestiona cada cliente).
+# POST solo se reintenta si la conexión no llegó a establecerse: reenviarlo
+# tras un timeout de lectura duplicaría p. ej. un trabajo batch de Geoapify.
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.3"))
+
+_session: Optional[requests.Session] = None
+_timeout = HTTP_TIMEOUT
+_lock = threading.Lock()
+
+
+def _build_session(pool_connections: int, pool_maxsize: int, retries: int) -> requests.Session:
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure(
+    pool_connections: int = HTTP_POOL_CONNECTIONS,
+    pool_maxsize: int = HTTP_POOL_MAXSIZE,
+    timeout: float = HTTP_TIMEOUT,
+    retries: int = HTTP_RETRIES,
+) -> requests.Session:
+    """(Re)crea la sesión compartida con los tamaños de pool, timeout y reintentos dados."""
+    global _session, _timeout
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = _build_session(pool_connections, pool_maxsize, retries)
+        _timeout = timeout
+        return _session
+
+
+def get_session() -> requests.Session:
+    """Sesión compartida por todo el proceso (se crea al primer uso)."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session(HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_RETRIES)
+    return _session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", _timeout)
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
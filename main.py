@@ -5,12 +5,17 @@ import streamlit as st
 import pandas as pd
 
 from data_processing import (
-    load_and_clean_data,
+    CSV_CHUNKSIZE,
+    load_and_clean_data_cached,
+    build_province_index,
     filter_by_province,
     detect_libraries,
+    analyze_all_provinces,
     geocode_libraries,
     get_library_statistics,
+    build_statistics_cube,
     build_books_ranking_from_libraries,
+    hash_archivo,
 )
 
 from mapping import create_map_html
@@ -91,11 +96,26 @@ uploaded_file = st.file_uploader("Sube tu archivo CSV", type=["csv"])
 if not uploaded_file:
     st.stop()
 
-try:
-    df = load_and_clean_data(uploaded_file)
-except Exception as e:
-    st.error(f"Error leyendo el CSV: {e}")
-    st.stop()
+# El archivo se hashea y se carga una sola vez por subida: los reruns
+# (sliders, checkboxes) reutilizan el DataFrame de la sesión sin volver a
+# leer el archivo ni el caché Feather
+clave_subida = (getattr(uploaded_file, "file_id", uploaded_file.name), uploaded_file.size)
+cargado = st.session_state.get("dataset")
+
+if cargado is not None and cargado[0] == clave_subida:
+    df = cargado[1]
+else:
+    try:
+        df = load_and_clean_data_cached(
+            uploaded_file,
+            chunksize=CSV_CHUNKSIZE,
+            compacto=True,
+            digest=hash_archivo(uploaded_file),
+        )
+    except Exception as e:
+        st.error(f"Error leyendo el CSV: {e}")
+        st.stop()
+    st.session_state["dataset"] = (clave_subida, df)
 
 with st.expander("Ver primeras filas del dataset"):
     st.dataframe(df.head())
@@ -123,10 +143,22 @@ except Exception:
 
 st.success(f"📍 Provincia detectada automáticamente: **{provincia_sel}**")
 
-df_provincia = filter_by_province(df, provincia_sel)
+province_index = build_province_index(df)
+df_provincia = filter_by_province(df, provincia_sel, index=province_index)
 
 st.write(f"Total de registros en **{provincia_sel}**: {len(df_provincia)}")
 
+if st.checkbox("Ver resumen de todas las provincias (modo por lotes)"):
+    with st.spinner("Analizando todas las provincias en una sola pasada..."):
+        df_resumen = analyze_all_provinces(df, index=province_index)
+    st.dataframe(df_resumen.drop(columns=["conteo_por_parroquia"]))
+    st.download_button(
+        "Descargar resumen (CSV)",
+        df_resumen.drop(columns=["conteo_por_parroquia"]).to_csv(index=False),
+        file_name="resumen_provincias.csv",
+        mime="text/csv",
+    )
+
 # ============================
 # 3. DETECCIÓN DE LIBRERÍAS
 # ============================
@@ -183,7 +215,17 @@ if df_geo is None or df_geo.empty:
 else:
     st.success(f"✅ {len(df_geo)} librerías geocodificadas exitosamente")
 
-stats = get_library_statistics(df_provincia, df_librerias, df_geo)
+# Cubo de estadísticas (una sola agrupación); las métricas se leen de él.
+# Se construye una vez por dataset (clave: hash del archivo), no en cada rerun.
+@st.cache_data(max_entries=4, show_spinner=False)
+def _cubo_estadisticas(digest: str, _df: pd.DataFrame):
+    return build_statistics_cube(_df)
+
+
+stats_cube = _cubo_estadisticas(df.attrs["hash_archivo"], df)
+stats = get_library_statistics(
+    df_provincia, df_librerias, df_geo, cube=stats_cube, provincia=provincia_sel
+)
 
 # Tres tarjetas antes del mapa
 col1, col2, col3 = st.columns(3)
@@ -194,6 +236,13 @@ col3.metric("Parroquia con más librerías", stats["parroquia_top"] or "N/D")
 with st.expander("Conteo de librerías por parroquia"):
     st.write(pd.DataFrame.from_dict(stats["conteo_por_parroquia"], orient="index", columns=["Cantidad"]))
 
+if stats.get("conteo_por_ciiu"):
+    with st.expander("Librerías por cantón y por código CIIU"):
+        st.write(f"Librerías inactivas: {stats['librerias_inactivas']} · "
+                 f"Porcentaje sobre registros: {stats['porcentaje_librerias']}%")
+        st.write(pd.DataFrame.from_dict(stats["conteo_por_canton"], orient="index", columns=["Cantidad"]))
+        st.write(pd.DataFrame.from_dict(stats["conteo_por_ciiu"], orient="index", columns=["Cantidad"]))
+
 # Mapa
 st.subheader(f"🗺️ Mapa de librerías en {provincia_sel}")
 
@@ -201,7 +250,8 @@ if df_geo.empty:
     st.error(f"❌ No hay librerías geocodificadas para la provincia seleccionada (**{provincia_sel}**).")
     st.info("El análisis continuará sin el mapa geográfico.")
 else:
-    html_map = create_map_html(df_geo, provincia_sel)
+    vista_densidad = st.checkbox("Mostrar densidad (grilla agregada) en lugar de marcadores")
+    html_map = create_map_html(df_geo, provincia_sel, modo="density" if vista_densidad else "auto")
     st.components.v1.html(html_map, height=600)
 
 # ============================
@@ -1,27 +1,63 @@
 # mapping.py
 
-import unicodedata
+import hashlib
+import threading
+from collections import OrderedDict
+
 import folium
+import numpy as np
+import pandas as pd
+from branca.colormap import LinearColormap
+from folium.plugins import FastMarkerCluster
+
+from text_normalization import normalize_key, normalize_key_series
 
 
 def _norm(text: str) -> str:
     """Normaliza cadenas para comparación exacta de provincia."""
-    if text is None:
-        return ""
-    text = unicodedata.normalize("NFKD", str(text))
-    text = "".join(c for c in text if not unicodedata.combining(c))
-    return text.strip().lower()
+    return normalize_key(text)
+
+
+# Por encima de este número de puntos se usa la capa de clúster
+MAP_CLUSTER_THRESHOLD = 300
+
+# Celdas por lado (eje más largo) de la grilla de densidad
+MAP_DENSITY_BINS = 40
+
+# Mapas renderizados que se conservan en memoria (LRU)
+MAP_HTML_CACHE_SIZE = 16
 
+# Columnas que intervienen en el dibujo del mapa (entran en la huella)
+_COLUMNAS_MAPA = ("lat", "lon", "NOMBRE_FANTASIA_COMERCIAL", "parroquia", "canton")
 
-def create_map_html(df_geo, provincia: str) -> str:
+_html_cache: "OrderedDict[str, str]" = OrderedDict()
+_html_cache_lock = threading.Lock()
+
+# Crea cada marcador en el navegador a partir de [lat, lon, popup]
+_CLUSTER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2]);
+    return marker;
+}
+"""
+
+
+def create_map_html(df_geo, provincia: str, modo: str = "auto") -> str:
     """
     Crea un mapa Folium con las librerías geocodificadas y filtra por provincia.
     Usa provincia_geo (retornada por Geoapify) como fuente de verdad.
+    modo: "markers" (un folium.Marker por fila), "cluster" (capa de clúster
+    en el cliente con un solo arreglo de coordenadas), "density" (grilla de
+    densidad agregada con NumPy, una sola capa GeoJSON) o "auto" (cluster
+    por encima de MAP_CLUSTER_THRESHOLD puntos).
+    El HTML se guarda bajo una huella de los datos filtrados, de modo que
+    los reruns de Streamlit con los mismos datos no vuelven a dibujarlo.
     """
     if df_geo is None or df_geo.empty:
         return "<h3>No hay datos geocodificados para mostrar.</h3>"
 
-    df = df_geo.copy()
+    df = df_geo
 
     # Filtrado estricto usando provincia_geo (retornada por Geoapify) como fuente de verdad
     prov_norm = _norm(provincia)
@@ -29,21 +65,69 @@ def create_map_html(df_geo, provincia: str) -> str:
         # Priorizar provincia_geo (retornada por Geoapify) para máxima precisión
         if "provincia_geo" in df.columns:
             # Filter: provincia_geo must contain the target province name
-            df = df[df["provincia_geo"].apply(lambda x: prov_norm in _norm(x))].copy()
+            df = df[normalize_key_series(df["provincia_geo"]).str.contains(prov_norm, regex=False)]
         
         # Additional filter: also check provincia column if exists
         if "provincia" in df.columns and not df.empty:
-            df = df[df["provincia"].apply(lambda x: prov_norm in _norm(x))].copy()
+            df = df[normalize_key_series(df["provincia"]).str.contains(prov_norm, regex=False)]
 
     if df.empty:
         return "<h3>No hay librerías geocodificadas para la provincia seleccionada.</h3>"
 
+    if modo == "auto":
+        modo = "cluster" if len(df) > MAP_CLUSTER_THRESHOLD else "markers"
+
+    clave = f"{map_fingerprint(df)}|{prov_norm}|{modo}"
+    with _html_cache_lock:
+        html = _html_cache.get(clave)
+        if html is not None:
+            _html_cache.move_to_end(clave)
+            return html
+
+    html = _render_map(df, modo)
+
+    with _html_cache_lock:
+        _html_cache[clave] = html
+        while len(_html_cache) > MAP_HTML_CACHE_SIZE:
+            _html_cache.popitem(last=False)
+
+    return html
+
+
+def map_fingerprint(df) -> str:
+    """Huella (blake2b) de las columnas que se dibujan en el mapa."""
+    h = hashlib.blake2b(digest_size=16)
+    for col in _COLUMNAS_MAPA:
+        if col in ("lat", "lon"):
+            valores = pd.to_numeric(df[col], errors="coerce") if col in df.columns else None
+        else:
+            valores = _columna_texto(df, col)
+        h.update(col.encode("utf-8"))
+        if valores is not None:
+            h.update(pd.util.hash_pandas_object(valores, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def clear_map_cache() -> None:
+    with _html_cache_lock:
+        _html_cache.clear()
+
+
+def _render_map(df, modo: str) -> str:
     # Centrar el mapa en el promedio de las coordenadas filtradas
     center_lat = df["lat"].astype(float).mean()
     center_lon = df["lon"].astype(float).mean()
     mapa = folium.Map(location=[center_lat, center_lon], zoom_start=9)
 
-    for _, row in df.iterrows():
+    if modo == "cluster":
+        _add_cluster_layer(mapa, df)
+        return mapa._repr_html_()
+
+    if modo == "density":
+        _add_density_layer(mapa, df)
+        return mapa._repr_html_()
+
+    for row in df.to_dict("records"):
         lat = row.get("lat")
         lon = row.get("lon")
         if lat is None or lon is None:
@@ -61,3 +145,98 @@ def create_map_html(df_geo, provincia: str) -> str:
         ).add_to(mapa)
 
     return mapa._repr_html_()
+
+
+def _columna_texto(df, col: str, default: str = ""):
+    if col in df.columns:
+        return df[col].astype(object).fillna(default).astype(str)
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _add_cluster_layer(mapa, df) -> None:
+    """
+    Capa de clúster del lado del cliente: un único arreglo [lat, lon, popup]
+    y los marcadores se crean en el navegador (FastMarkerCluster).
+    """
+    coords = df[["lat", "lon"]].apply(pd.to_numeric, errors="coerce")
+    validas = coords.notna().all(axis=1)
+    df = df[validas]
+    coords = coords[validas]
+
+    popups = (
+        "<b>" + _columna_texto(df, "NOMBRE_FANTASIA_COMERCIAL", "Sin nombre") + "</b><br>"
+        + _columna_texto(df, "parroquia") + " - " + _columna_texto(df, "canton")
+    )
+    data = list(zip(coords["lat"].round(6).tolist(), coords["lon"].round(6).tolist(), popups.tolist()))
+
+    FastMarkerCluster(data=data, callback=_CLUSTER_CALLBACK).add_to(mapa)
+
+
+def density_grid(lat, lon, bins: int = MAP_DENSITY_BINS):
+    """
+    Agrupa coordenadas en una grilla regular (vectorizado con NumPy).
+    Devuelve (celdas, conteos, tamaño, origen): celdas es un arreglo
+    (n, 2) de índices (fila, columna) y origen es (lat_min, lon_min).
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    validas = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon = lat[validas], lon[validas]
+
+    if lat.size == 0:
+        return np.empty((0, 2), dtype=int), np.empty(0, dtype=int), 0.0, (0.0, 0.0)
+
+    origen = (lat.min(), lon.min())
+    extension = max(np.ptp(lat), np.ptp(lon))
+    tamano = extension / bins if extension > 0 else 0.01
+
+    filas = np.floor((lat - origen[0]) / tamano).astype(int)
+    columnas = np.floor((lon - origen[1]) / tamano).astype(int)
+    celdas, conteos = np.unique(np.column_stack([filas, columnas]), axis=0, return_counts=True)
+
+    return celdas, conteos, tamano, origen
+
+
+def _add_density_layer(mapa, df, bins: int = MAP_DENSITY_BINS) -> None:
+    """Una sola capa GeoJSON con las celdas de la grilla coloreadas por conteo."""
+    lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy()
+    lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy()
+    celdas, conteos, tamano, (lat0, lon0) = density_grid(lat, lon, bins)
+    if len(conteos) == 0:
+        return
+
+    colormap = LinearColormap(
+        ["#ffffb2", "#fd8d3c", "#bd0026"],
+        vmin=1,
+        vmax=max(int(conteos.max()), 2),
+        caption="Librerías por celda",
+    )
+
+    features = []
+    for (fila, columna), n in zip(celdas.tolist(), conteos.tolist()):
+        s = lat0 + fila * tamano
+        w = lon0 + columna * tamano
+        n_, e = s + tamano, w + tamano
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {"librerias": n, "color": colormap(n)},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[w, s], [e, s], [e, n_], [w, n_], [w, s]]],
+                },
+            }
+        )
+
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        name="Densidad de librerías",
+        style_function=lambda f: {
+            "fillColor": f["properties"]["color"],
+            "color": f["properties"]["color"],
+            "weight": 0.5,
+            "fillOpacity": 0.6,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=["librerias"], aliases=["Librerías"]),
+    ).add_to(mapa)
+    colormap.add_to(mapa)
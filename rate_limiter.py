@@ -0,0 +1,69 @@
+# rate_limiter.py
+# Limitador token-bucket y backoff exponencial compartidos por los clientes HTTP
+
+import random
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket seguro entre hilos: permite ráfagas de hasta `capacity`
+    peticiones y un ritmo sostenido de `rate` peticiones por segundo.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate debe ser mayor que 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now <= self._last:
+            return
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Bloquea hasta disponer de `tokens` y los consume."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                else:
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Detiene a todos los consumidores (p. ej. tras un 429) y vacía el bucket."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._last = max(now, self._paused_until)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Espera exponencial con jitter para el intento `attempt` (0, 1, 2...)."""
+    delay = min(cap, base * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Interpreta la cabecera Retry-After expresada en segundos."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
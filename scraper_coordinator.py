@@ -4,7 +4,9 @@
 import requests
 from typing import List, Tuple
 from collections import Counter
-import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fetch_scheduler
 
 # URLs de los servicios scraper
 SCRAPER_GOOGLE_URL = "http://localhost:8001/search"  # Scraper de Google
@@ -31,8 +33,9 @@ def obtener_catalogo_google(nombre_libreria: str, ciudad: str = "") -> Tuple[Lis
         
         params = {k: v for k, v in params.items() if v}
         
-        response = requests.get(
+        response = fetch_scheduler.get(
             SCRAPER_GOOGLE_URL,
+            robots=False,
             params=params,
             timeout=TIMEOUT
         )
@@ -67,8 +70,9 @@ def obtener_catalogo_facebook(url_facebook: str) -> List[str]:
     try:
         payload = {"url": url_facebook}
         
-        response = requests.post(
+        response = fetch_scheduler.post(
             SCRAPER_FACEBOOK_URL,
+            robots=False,
             json=payload,
             timeout=TIMEOUT
         )
@@ -97,6 +101,8 @@ def obtener_ranking_libros_completo(
 ) -> tuple:
     """
     Obtiene ranking completo usando Google scraper y opcionalmente Facebook.
+    Las consultas se lanzan en paralelo; fetch_scheduler limita la
+    concurrencia y el ritmo hacia cada servicio.
     
     Returns:
         Tuple de (ranking, libro_mas_popular)
@@ -112,24 +118,27 @@ def obtener_ranking_libros_completo(
     print(f"\n🌐 Intentando scrapers especializados para {len(nombres)} librerías...")
     
     # Paso 1: Buscar con Google scraper
-    for i, nombre in enumerate(nombres, 1):
-        if not nombre or nombre.strip() == "":
-            continue
-            
-        print(f"  [{i}/{len(nombres)}] {nombre}...", end=" ")
-        
+    tareas = [(i, nombre) for i, nombre in enumerate(nombres, 1) if nombre and nombre.strip() != ""]
+
+    def _google(tarea):
+        i, nombre = tarea
+        prefijo = f"  [{i}/{len(nombres)}] {nombre}..."
         try:
             libros, redes = obtener_catalogo_google(nombre)
             if libros:
-                titulos.extend(libros)
-                redes_encontradas.extend(redes)
-                print(f"✅ ({len(libros)} libros)")
+                print(f"{prefijo} ✅ ({len(libros)} libros)")
             else:
-                print("⚠️")
+                print(f"{prefijo} ⚠️")
+            return libros, redes
         except Exception as e:
-            print(f"❌ ({str(e)[:20]})")
-        
-        time.sleep(0.5)
+            print(f"{prefijo} ❌ ({str(e)[:20]})")
+            return [], []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(fetch_scheduler.SCRAPE_WORKERS, len(tareas)))) as ex:
+        for libros, redes in ex.map(_google, tareas):
+            if libros:
+                titulos.extend(libros)
+                redes_encontradas.extend(redes)
     
     # Paso 2: Si encontramos Facebook, usar el scraper de Facebook
     if usar_facebook and redes_encontradas:
@@ -137,16 +146,20 @@ def obtener_ranking_libros_completo(
         
         facebook_urls = [r for r in redes_encontradas if "facebook.com" in r.lower()]
         
-        for url in facebook_urls[:2]:
+        def _facebook(url):
             try:
                 libros_fb = obtener_catalogo_facebook(url)
                 if libros_fb:
-                    titulos.extend(libros_fb)
                     print(f"  ✅ {url[:50]}... ({len(libros_fb)} libros)")
+                return libros_fb
             except Exception as e:
                 print(f"  ❌ {url[:50]}... ({str(e)[:20]})")
-            
-            time.sleep(1)
+                return []
+
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            for libros_fb in ex.map(_facebook, facebook_urls[:2]):
+                if libros_fb:
+                    titulos.extend(libros_fb)
     
     # Paso 3: Crear ranking
     if not titulos:
@@ -1,11 +1,19 @@
 # scraper_google.py
 # Scraper de librerías usando DuckDuckGo - INTEGRADO
 
-import requests
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
-import unicodedata
 from urllib.parse import unquote, parse_qs, urlparse
-from typing import Optional
+from typing import List, Optional
+
+import fetch_scheduler
+import http_cache
+import http_client
+from catalog_extraction import EXCLUIR, extraer_titulos_perfilado
+from text_normalization import strip_accents
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; LibreriaScraper/5.0)"
@@ -15,9 +23,7 @@ HEADERS = {
 # NORMALIZAR TEXTO
 # ============================================================
 def normalizar(text: str):
-    text = unicodedata.normalize("NFKD", text)
-    text = "".join(c for c in text if not unicodedata.combining(c))
-    return text.strip()
+    return strip_accents(text).strip()
 
 # ============================================================
 # UBICACIONES GEOAPIFY
@@ -30,7 +36,7 @@ def buscar_ubicaciones(query: str):
     params = {"text": q, "lang": "es", "apiKey": GEOAPIFY_KEY}
 
     try:
-        r = requests.get(url, params=params, timeout=10)
+        r = http_client.get(url, params=params, timeout=10)
         r.raise_for_status()
 
         data = r.json()
@@ -75,7 +81,7 @@ def buscar_en_google(query: str):
     }
     
     try:
-        r = requests.post(search_url, data=data, headers=headers, timeout=15)
+        r = fetch_scheduler.post(search_url, robots=False, data=data, headers=headers, timeout=15)
         r.raise_for_status()
         
         soup = BeautifulSoup(r.text, "html.parser")
@@ -118,13 +124,6 @@ def buscar_en_google(query: str):
 # ============================================================
 SOCIAL = ["facebook.com", "instagram.com", "x.com", "twitter.com", "tiktok.com", "youtube.com"]
 
-# Palabras que indican papelería o no-libros
-EXCLUIR = [
-    "papeler", "utiles", "escolar", "escolares",
-    "juguet", "oficina", "kinder", "ferreter", 
-    "bazar", "souvenir", "supermercado", "farmacia"
-]
-
 # Palabras que indican venta de libros
 INCLUIR = [
     "libr", "book", "books", "bookstore",
@@ -165,78 +164,95 @@ def clasificar_links(links):
 # ============================================================
 # SCRAPER DE CATALOGO – SOLO LIBROS
 # ============================================================
-def extraer_catalogo(url: str):
+def extraer_catalogo(url: str, cancel: Optional[threading.Event] = None):
+    """
+    Títulos del catálogo de `url`. Con `cancel` activado la descarga no
+    empieza (o no se analiza si ya terminó) y se devuelve una lista vacía.
+    """
+    if cancel is not None and cancel.is_set():
+        return []
     try:
-        r = requests.get(url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(r.text, "html.parser")
-
-        items = []
-
-        # selectores comunes en tiendas de libros
-        selectores = [
-            ".book-item",
-            ".producto-libro",
-            ".product-title",
-            ".woocommerce-loop-product__title",
-            ".book-title",
-            ".titulo-libro",
-            ".entry-title",
-            "li.product",
-            "article"
-        ]
-
-        for sel in selectores:
-            for el in soup.select(sel):
-                t = el.get_text(strip=True)
-                if 3 < len(t) < 120:
-                    items.append(t)
-
-        # Buscar títulos relacionados con literatura
-        PALABRAS_LIBROS = [
-            "libro", "novela", "cuento", "autor", "editorial",
-            "tapa dura", "tapa blanda", "historia", "poesía",
-            "literatura", "ensayo", "biografia"
-        ]
-
-        for tag in soup.find_all(["h1", "h2", "h3", "h4", "a"]):
-            t = tag.get_text(strip=True)
-            if any(w in t.lower() for w in PALABRAS_LIBROS) and 3 < len(t) < 120:
-                items.append(t)
-
-        # limpieza
-        clean = []
-        for i in items:
-            low = i.lower()
-            # descartar basura o papelería infiltrada
-            if any(x in low for x in EXCLUIR):
-                continue
-            if low.startswith("leer más"):
-                continue
-            clean.append(i)
-
-        return list(dict.fromkeys(clean))[:40]
-
+        html = http_cache.fetch_text(url, headers=HEADERS, timeout=10, cancel=cancel)
     except Exception:
         return []
+    if cancel is not None and cancel.is_set():
+        return []
+
+    return extraer_titulos_perfilado(html, url, limite=40)
 
 # ============================================================
 # FUNCIÓN PRINCIPAL DE BÚSQUEDA
 # ============================================================
-def buscar(name: str, city: Optional[str] = None):
-    """Busca catálogo de libros de una librería (función principal)."""
+# Páginas candidatas que se descargan a la vez
+BUSCAR_MAX_CANDIDATOS = int(os.getenv("BUSCAR_MAX_CANDIDATOS", "5"))
+
+# Mínimo de títulos para aceptar una página como catálogo
+CATALOGO_MINIMO = 3
+
+# Pool propio (no el executor por defecto): asyncio.run no espera a que
+# terminen las descargas canceladas que siguen en curso
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="buscar")
+
+
+async def _en_hilo(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def _primer_catalogo(urls: List[str], max_candidatos: int = BUSCAR_MAX_CANDIDATOS):
+    """
+    Descarga hasta `max_candidatos` páginas a la vez (ventana deslizante) y
+    devuelve el primer catálogo con CATALOGO_MINIMO títulos o más. Al
+    terminar se activa `parar`: las descargas que aún esperan hilo o turno
+    del host (fetch_scheduler) se descartan sin llegar a la red, y las que
+    ya están en vuelo no se analizan.
+    """
+    pendientes = iter(urls)
+    en_curso = set()
+    parar = threading.Event()
+
+    def lanzar():
+        url = next(pendientes, None)
+        if url is not None:
+            en_curso.add(asyncio.ensure_future(_en_hilo(extraer_catalogo, url, parar)))
+
+    for _ in range(max(1, max_candidatos)):
+        lanzar()
+
+    try:
+        while en_curso:
+            hechas, _ = await asyncio.wait(en_curso, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in hechas:
+                en_curso.discard(tarea)
+                catalogo = tarea.result()
+                if len(catalogo) >= CATALOGO_MINIMO:
+                    return catalogo
+                lanzar()
+        return []
+    finally:
+        parar.set()
+        for tarea in en_curso:
+            tarea.cancel()
+
+
+async def buscar_async(
+    name: str,
+    city: Optional[str] = None,
+    max_candidatos: int = BUSCAR_MAX_CANDIDATOS,
+):
+    """
+    Versión concurrente de buscar(): geocodificación y búsqueda web en
+    paralelo y descarga simultánea de las páginas candidatas.
+    """
     query = f"{name} {city}" if city else name
 
-    ubicaciones = buscar_ubicaciones(query)
-    links = buscar_en_google(query)
+    ubicaciones, links = await asyncio.gather(
+        _en_hilo(buscar_ubicaciones, query),
+        _en_hilo(buscar_en_google, query),
+    )
     paginas_web, redes = clasificar_links(links)
 
     # Extraer catálogo (solo si parece una librería real)
-    catalogo = []
-    for w in paginas_web:
-        c = extraer_catalogo(w)
-        if len(c) >= 3:
-            catalogo = c
-            break
+    catalogo = await _primer_catalogo(paginas_web, max_candidatos)
 
     return {
         "query": query,
@@ -247,6 +263,11 @@ def buscar(name: str, city: Optional[str] = None):
         "catalogo_detectado": catalogo
     }
 
+
+def buscar(name: str, city: Optional[str] = None):
+    """Busca catálogo de libros de una librería (función principal)."""
+    return asyncio.run(buscar_async(name, city))
+
 # ============================================================
 # ENDPOINT FASTAPI (OPCIONAL - para uso como servidor)
 # ============================================================
@@ -266,8 +287,8 @@ if __name__ != "__main__":
         )
 
         @app.get("/search")
-        def search_endpoint(name: str, city: Optional[str] = None):
-            return buscar(name, city)
+        async def search_endpoint(name: str, city: Optional[str] = None):
+            return await buscar_async(name, city)
 
     except ImportError:
         pass
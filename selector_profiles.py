@@ -0,0 +1,67 @@
+# selector_profiles.py
+# Perfiles persistentes (SQLite) de los selectores que funcionan en cada dominio
+
+import json
+import os
+import time
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from sqlite_store import LazyDefault, SQLiteStore
+
+# Ruta del almacén; una cadena vacía lo desactiva
+SELECTOR_PROFILES_PATH = os.getenv(
+    "SELECTOR_PROFILES_PATH", os.path.join(".cache", "selector_profiles.sqlite")
+)
+
+
+def dominio_de(url: str) -> str:
+    """Dominio de una URL sin el prefijo www. ('' si no se puede interpretar)."""
+    netloc = urlparse(url).netloc.lower()
+    return netloc[4:] if netloc.startswith("www.") else netloc
+
+
+class SelectorProfileStore(SQLiteStore):
+    """
+    Guarda por dominio la lista de selectores que produjeron títulos en la
+    última extracción completa.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS perfiles (
+            dominio    TEXT PRIMARY KEY,
+            selectores TEXT NOT NULL,
+            updated    REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str = SELECTOR_PROFILES_PATH):
+        super().__init__(path)
+
+    def get(self, dominio: str) -> Optional[List[str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT selectores FROM perfiles WHERE dominio = ?", (dominio,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, dominio: str, selectores: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO perfiles (dominio, selectores, updated) VALUES (?, ?, ?)",
+                (dominio, json.dumps(selectores), time.time()),
+            )
+
+    def delete(self, dominio: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM perfiles WHERE dominio = ?", (dominio,))
+
+
+_default_store = LazyDefault(
+    lambda: SelectorProfileStore(SELECTOR_PROFILES_PATH) if SELECTOR_PROFILES_PATH else None
+)
+
+
+def get_default_profile_store() -> Optional[SelectorProfileStore]:
+    """Almacén compartido del proceso (None si SELECTOR_PROFILES_PATH está vacío)."""
+    return _default_store.get()
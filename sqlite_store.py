@@ -0,0 +1,59 @@
+# sqlite_store.py
+# Base común de los almacenes SQLite (cachés, almacén de geocodificación, perfiles)
+
+import os
+import sqlite3
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SQLiteStore:
+    """
+    Conexión SQLite compartida entre hilos y protegida por un lock. Las
+    subclases definen SCHEMA (CREATE TABLE IF NOT EXISTS ...) y usan
+    self._lock / self._conn en sus consultas. ":memory:" crea una base en
+    memoria (útil para pruebas).
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if self.SCHEMA:
+            with self._lock, self._conn:
+                self._conn.execute(self.SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class LazyDefault(Generic[T]):
+    """
+    Instancia compartida del proceso, creada al primer uso con doble
+    verificación bajo lock (varios hilos no crean varias conexiones).
+    La fábrica devuelve None para desactivarla (p. ej. ruta vacía); si
+    falla, get() devuelve None y se reintenta en la próxima llamada.
+    """
+
+    def __init__(self, factory: Callable[[], Optional[T]]):
+        self._factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[T]:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    try:
+                        self._instance = self._factory()
+                    except Exception:
+                        return None
+        return self._instance
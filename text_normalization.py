@@ -0,0 +1,85 @@
+# text_normalization.py
+# Normalización de texto compartida (tildes, mayúsculas, espacios)
+
+import unicodedata
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+# Los datos del SRI tienen pocos valores distintos por columna: basta con
+# normalizar cada valor una vez y reutilizar el resultado.
+CACHE_SIZE = 1 << 16
+
+
+# ============================================================
+# NORMALIZACIÓN DE UN VALOR (MEMOIZADA)
+# ============================================================
+
+@lru_cache(maxsize=CACHE_SIZE)
+def strip_accents(text: str) -> str:
+    """Elimina tildes y diacríticos (NFKD sin caracteres combinantes)."""
+    text = unicodedata.normalize("NFKD", text)
+    if text.isascii():
+        return text
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize_text(text: str) -> str:
+    return " ".join(strip_accents(text).lower().strip().split())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _normalize_province(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name)
+    name = name.encode("ascii", "ignore").decode("utf-8")
+    return name.strip().upper()
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza texto, elimina tildes y espacios repetidos."""
+    if not isinstance(text, str):
+        text = str(text) if text is not None else ""
+    return _normalize_text(text)
+
+
+def normalize_province(name: str) -> str:
+    """Convierte 'Los Ríos' → 'LOS RIOS', eliminando tildes y espacios."""
+    if not isinstance(name, str):
+        name = str(name)
+    return _normalize_province(name)
+
+
+def normalize_key(text: str) -> str:
+    """Clave de comparación: sin tildes, minúsculas y sin espacios extremos."""
+    if text is None:
+        return ""
+    return strip_accents(str(text)).strip().lower()
+
+
+# ============================================================
+# OPERACIONES VECTORIZADAS SOBRE SERIES
+# ============================================================
+
+def map_unique(series: pd.Series, func: Callable[[str], str]) -> pd.Series:
+    """
+    Aplica func una sola vez por valor distinto (factorize + take) y
+    devuelve una Serie alineada con el índice original.
+    """
+    codes, uniques = pd.factorize(series, sort=False, use_na_sentinel=False)
+    mapped = np.array([func(v) for v in uniques], dtype=object)
+    return pd.Series(mapped[codes], index=series.index, name=series.name)
+
+
+def normalize_text_series(series: pd.Series) -> pd.Series:
+    return map_unique(series, normalize_text)
+
+
+def normalize_province_series(series: pd.Series) -> pd.Series:
+    return map_unique(series, normalize_province)
+
+
+def normalize_key_series(series: pd.Series) -> pd.Series:
+    return map_unique(series, normalize_key)